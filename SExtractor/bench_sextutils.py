@@ -0,0 +1,193 @@
+# Benchmarks for sextutils_ferguson.py
+#
+# Writes a synthetic SExtractor catalog to a temporary file and times
+# the different ways of reading it.
+#
+# Usage: python bench_sextutils.py [nrows] [ncolumns]
+
+import os, sys
+import tempfile
+import time
+import numpy as N
+
+import sextutils_ferguson as se
+
+def makecatalog(fname,nrows,ncolumns,seed=42):
+    """ Write a catalog with an integer id column followed by
+        ncolumns-1 float columns in a mix of fixed and exponential format.
+    """
+    rng = N.random.RandomState(seed)
+    out = open(fname,'w')
+    out.write('#   1 NUMBER   Running object number\n')
+    for c in range(2,ncolumns+1):
+        out.write('#   %d COL%d   synthetic column\n' % (c,c))
+    fmt = '%10d' + ''.join([' %12.5e',' %10.4f'][c%2]
+                           for c in range(2,ncolumns+1)) + '\n'
+    block = 10000
+    for start in range(0,nrows,block):
+        n = min(block,nrows-start)
+        data = [N.arange(start+1,start+n+1)]
+        for c in range(2,ncolumns+1):
+            data.append(rng.uniform(0.,1000.,n))
+        for row in zip(*data):
+            out.write(fmt % row)
+    out.close()
+
+def timeit(label,func,*args,**keywords):
+    t0 = time.time()
+    ret = func(*args,**keywords)
+    dt = time.time()-t0
+    print "%-40s %8.3f s" % (label,dt)
+    return ret,dt
+
+def legacy_convert(d,types,lines):
+    """ The per-row conversion used before convertcolumns """
+    colentries = [l.split() for l in lines]
+    columns = {}
+    for k in d:
+        columns[k] = se.getcolvalues(d[k],types[k],colentries)
+    return columns
+
+def bench_convert(fname):
+    c = se.se_catalog(fname,readfile=False)
+    (d,lines,ncol,header) = se.initcat(fname)
+    c.gettypes(100)
+    old,told = timeit("getcolvalues (per row, per column)",
+                      legacy_convert,d,c._type,lines)
+    new,tnew = timeit("convertcolumns (single pass)",
+                      se.convertcolumns,d,c._type,lines,ncol)
+    for k in d:
+        assert N.all(old[k] == new[k]), k
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def legacy_types(d,lines):
+    """ Column types from a fmt object per cell, as gettypes used to """
+    types = {}
+    fmts = {}
+    for k in d:
+        fmts[k],tp,types[k] = se.type_and_fmt(se.extract_column(d[k],lines))
+    return types,fmts
+
+def bench_types(fname):
+    (d,lines,ncol,header) = se.initcat(fname)
+    old,told = timeit("type_and_fmt, all rows",legacy_types,d,lines)
+    new,tnew = timeit("columntypes, all rows",
+                      se.columntypes,d,lines,len(lines))
+    assert old == new
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def legacy_writeto(c,outname):
+    """ One row() and one write per row, as writeto used to """
+    out = open(outname,'w')
+    out.write(c._header)
+    for k in range(len(c)):
+        out.write(c.row(k))
+    out.close()
+
+def bench_write(fname):
+    c = se.se_catalog(fname)
+    old = fname+'.old'
+    new = fname+'.new'
+    try:
+        x,told = timeit("writeto, row by row",legacy_writeto,c,old)
+        x,tnew = timeit("writeto, in blocks",c.writeto,new)
+        assert open(old).read() == open(new).read()
+        print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+    finally:
+        for f in [old,new]:
+            if os.path.isfile(f):
+                os.remove(f)
+
+def check_appendrows(fname):
+    """ Floats appended to an integer column survive writeto """
+    small = fname+'.small'
+    out = fname+'.out'
+    try:
+        f = open(small,'w')
+        f.write('#   1 NUMBER\n#   2 FLUX\n 1 10\n 2 20\n')
+        f.close()
+        c = se.se_catalog(small)
+        c.appendrows({'number':[3],'flux':[30.75]})
+        c.writeto(out)
+        assert list(se.se_catalog(out).flux) == [10.,20.,30.75]
+        c = se.se_catalog(small)
+        c.appendrows({'number':[3,4],'flux':[1e-05,12.5]})
+        c.writeto(out,clobber=True)
+        assert list(se.se_catalog(out).flux) == [10.,20.,1e-05,12.5]
+        print "%-40s %8s" % ("appendrows round trip","ok")
+    finally:
+        for f in [small,out]:
+            if os.path.isfile(f):
+                os.remove(f)
+
+def check_promotion(fname):
+    """ An integer column with a fraction in a row that gettypes did not
+        sample is read as floats, not garbage, and written back out with
+        its fractions """
+    small = fname+'.small'
+    out = fname+'.out'
+    try:
+        f = open(small,'w')
+        f.write('#   1 NUMBER\n#   2 FLUX\n#   3 NAME\n')
+        for i in range(300):
+            flux = ['%5d' % (10*i),'30.75'][i == 251]
+            f.write('%3d %s obj%03d\n' % (i,flux,i))
+        f.close()
+        expected = 10.*N.arange(300)
+        expected[251] = 30.75
+        for keywords in [{},{'lazy':True},{'columns':['flux']},
+                         {'fixedwidth':True}]:
+            c = se.se_catalog(small,**keywords)
+            assert N.all(c.flux == expected), keywords
+            c.writeto(out,clobber=True)
+            assert N.all(se.se_catalog(out).flux == expected), keywords
+        for chunk in se.iterchunks(small):
+            assert N.all(chunk['flux'] == expected)
+        print "%-40s %8s" % ("integer column promoted to float","ok")
+    finally:
+        for f in [small,out]:
+            if os.path.isfile(f):
+                os.remove(f)
+
+def bench_fixedwidth(fname):
+    old,told = timeit("se_catalog(compact=True)",
+                      se.se_catalog,fname,compact=True)
+    new,tnew = timeit("se_catalog(compact=True,fixedwidth=True)",
+                      se.se_catalog,fname,compact=True,fixedwidth=True)
+    for k in old._colnames:
+        assert N.all(getattr(old,k) == getattr(new,k)), k
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def read_two_columns(fname,lazy):
+    c = se.se_catalog(fname,lazy=lazy)
+    return c.number,c.col2
+
+def bench_lazy(fname):
+    old,told = timeit("se_catalog, 2 columns used",
+                      read_two_columns,fname,False)
+    new,tnew = timeit("se_catalog(lazy=True), 2 columns used",
+                      read_two_columns,fname,True)
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+if __name__ == "__main__":
+    nrows = 200000
+    ncolumns = 20
+    if len(sys.argv) > 1:
+        nrows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ncolumns = int(sys.argv[2])
+    fd,fname = tempfile.mkstemp(suffix='.cat')
+    os.close(fd)
+    try:
+        makecatalog(fname,nrows,ncolumns)
+        print "%d rows x %d columns, %.1f MB" % (nrows,ncolumns,
+                                   os.path.getsize(fname)/1.e6)
+        bench_convert(fname)
+        bench_lazy(fname)
+        bench_types(fname)
+        bench_write(fname)
+        check_appendrows(fname)
+        check_promotion(fname)
+        bench_fixedwidth(fname)
+    finally:
+        os.remove(fname)
@@ -30,6 +30,25 @@
 # v7.0 - H. Ferguson: rewrote to allow appending rows and columns
 #      - removed rw_catalog class, since se_catalog class now allows writing
 #      - Redid the column type checking to also figure out the print format
+# v7.1 - convertcolumns tokenizes the data once and converts every column
+#           in bulk with numpy, instead of one cell at a time
+#      - iterchunks reads catalogs too large for memory in blocks of rows
+#      - lazy=True reads each column the first time it is used
+#      - cache=True keeps memory-mapped binary copies of the columns
+#      - columnformat replaces type_and_fmt when sampling column types;
+#           each sampled line is split only once
+#      - writeto and printme format blocks of rows at a time, and can
+#           write a subset of the columns and rows
+#      - loadcatalogs reads many catalogs in parallel and joins them
+#      - columns= reads only the named columns
+#      - conesearch and nearest use a zoneindex of the sky positions
+#      - appendrows, at last, with buffers that grow by doubling
+#      - compact=True keeps line offsets instead of the split text
+#      - tailcatalog follows a catalog while it is being written
+#      - vector() returns vector parameters such as FLUX_APER as 2-d arrays
+#      - fixedwidth=True slices columns out of a memory-mapped file
+#      - writeto(append=True) and catalogwriter add rows to existing files
+#      - catalogs compressed with gzip, bzip2 or xz are read directly
 
 __version__ = '6.0'
 __author = 'Henry C. Ferguson, STScI'
@@ -38,6 +57,23 @@ import string
 import numpy as N
 import os, sys
 import re
+import shutil
+import cPickle as pickle
+import glob
+import time
+import mmap
+import cStringIO
+import functools
+import multiprocessing
+import zlib
+import bz2
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
 
 class se_catalog(object):
     """ Read a SExtractor-style catalog. 
@@ -52,6 +88,25 @@ class se_catalog(object):
            are returned as a list of ascii strings c.l. Useful if you want
            to do some special parsing of some sort. 
         preserve_case -- default (False) converts column names to lower case
+        lazy -- True means only convert a column the first time it is
+           used (e.g. c.mag_auto). Saves time and memory when only a
+           few columns of a wide catalog are needed.
+        cache -- True means save the parsed columns in a binary sidecar
+           directory (catalog+'.npcache') and, on later reads, memory-map
+           them from there instead of parsing the text. The sidecar is
+           rebuilt whenever the catalog's size or modification time
+           changes. A string gives the sidecar directory to use.
+        columns -- only read these columns: a list of names, e.g.
+           ['alpha_j2000','delta_j2000','mag_auto'], or a regular
+           expression matched against the start of each name. The other
+           columns are never split out or converted.
+        compact -- True means keep only the typed columns, not the text of
+           each row split into strings. line() then reads the row back
+           from the catalog file, using the saved offset of each line.
+        fixedwidth -- True means try slicing the columns straight out of
+           a memory-mapped copy of the file, when every data line has
+           the same length and the columns line up (as SExtractor writes
+           them). Otherwise the catalog is read the usual way.
 
         The input catalog MUST have a header with the SExtractor format:
            # 1 ID comment
@@ -66,14 +121,34 @@ class se_catalog(object):
         apertures. These will be read into attributes:
            c.flux_aper   # The first one
            c.flux_aper_1 # the second one, and so on
+        c.vector('flux_aper') returns all of them as one (nrows,napertures)
+        array, and the attributes above then become views into it.
 
         The case of aperture radii is a bit nasty, since these only
         appear in the SExtractor configuration file. Use parseconfig()
         to read that file.
     """
-    def __init__(self,cfile,readfile=True,preserve_case=False,ncheck=100):
+    def __init__(self,cfile,readfile=True,preserve_case=False,ncheck=100,
+                 lazy=False,cache=False,columns=None,compact=False,
+                 fixedwidth=False):
+        if cache and readfile:
+            if cache == True:
+                cache = cachename(cfile)
+            # The read options that change what is cached
+            self._options = (preserve_case,ncheck)
+            if self.readcache(cfile,cache,columns=columns,
+                              preserve_case=preserve_case,ncheck=ncheck):
+                return
+        if fixedwidth and readfile:
+            if self.readfixedwidth(cfile,preserve_case,ncheck,columns):
+                if cache:
+                    self.writecache(cache)
+                return
         # Initialize the catalog
         (d,lines,ncol,header) = initcat(cfile, preserve_case=preserve_case)
+        self._projected = columns is not None # Only some columns are read
+        if self._projected:
+            d = selectcolumns(d,columns)
         # Save these as hidden attributes (so as not to confuse with columns)
         self._d = d # This is a dictionary of just the column names
         self._l = lines # All of the data rows of the catalog, as a list
@@ -86,32 +161,70 @@ class se_catalog(object):
             self._colnames.append(coldict[k])
         if readfile:
             nlines = len(lines) # Number of data rows
-            # Turn each line into a list, for faster access later
-            self._colentries = range(nlines) 
-            for i in range(nlines):
-                self._colentries[i] = lines[i].split()
             # Check the formatting of at least some of the rows
             if ncheck == None or ncheck == 'all':  
                  ncheck = nlines
             self.gettypes(ncheck) # Only check a subset of the, for speed
-            # Extract the columns
+            if compact and compression(cfile) == None:
+                # Where each data line starts in the file, for line()
+                lengths = N.array([len(l) for l in lines],dtype=N.int64)
+                start = os.path.getsize(cfile)-lengths.sum()
+                self._offsets = start+N.cumsum(lengths)-lengths
+                del lengths
+            if lazy:
+                # Columns still to be read from self._l, and the
+                # names they have in self._type
+                self._pending = {}
+            else:
+                if not self._projected and not compact:
+                    # Turn each line into a list, for faster access later
+                    self._colentries = range(nlines) 
+                    for i in range(nlines):
+                        self._colentries[i] = lines[i].split()
+                # Extract the columns, all of them in one pass over the text
+                converted = convertcolumns(self._d,self._type,lines,ncol,
+                                           self._fmt)
             for k in self._d.keys():
-                contents = getcolvalues(self._d[k],self._type[k],
-                                        self._colentries)
                 try:
                     #Munge column name if it conflicts
                     test=self.__getattribute__(k)
                     newkey='c_'+k
                     print "--Column '%s' read in as '%s' to avoid conflicts"%(k,newkey)
-                    setattr(self,newkey,contents)
                     self._d[newkey]=self._d[k]
                     del self._d[k]
                 except AttributeError:
-                    setattr(self,k,contents)
-            delattr(self,'_l')
+                    newkey=k
+                if lazy:
+                    self._pending[newkey] = k
+                else:
+                    setattr(self,newkey,converted.pop(k))
+            if not lazy:
+                delattr(self,'_l')
+            if cache:
+                self.writecache(cache)
+
+    def __getattr__(self,name):
+        """ Read a column on first use, when the catalog is lazy """
+        # Only called when name is not already an attribute
+        pending = self.__dict__.get('_pending',{})
+        if name not in pending:
+            raise AttributeError(name)
+        k = pending[name]
+        values = getcolumn(self._d[name],self._type[k],self._l)
+        if self._type[k] == 'd' and values.dtype == N.float64:
+            self._type[k] = 'f' # Promoted by getcolumn
+            self._fmt[k] = promotedformat(self._fmt[k],
+                                          extract_column(self._d[name],self._l))
+        setattr(self,name,values)
+        del pending[name]
+        if not pending and hasattr(self,'_offsets'):
+            del self._l # All read, and line() can use the offsets
+        return values
 
     def __len__(self):
         """ Return the number of rows """
+        if self.__dict__.get('_pending'):
+            return len(self._l)               # No need to read a column
         col = getattr(self,self._colnames[0]) # Grab a column 
         return len(col)                       # return its length
 
@@ -121,9 +234,115 @@ class se_catalog(object):
     def line(self,i):
         """ Returns an assembled line of this catalog suitable for writing.
         Except it doesn't really, if we modified the individual columns..."""
-        ans = '    '.join(self._colentries[i])+'\n'
+        if hasattr(self,'_colentries') and i < len(self._colentries):
+            ans = '    '.join(self._colentries[i])+'\n'
+        elif hasattr(self,'_l') and i < len(self._l):
+            ans = '    '.join(self._l[i].split())+'\n'
+        elif hasattr(self,'_offsets') and i < len(self._offsets):
+            f = open(self._fname,'r')
+            f.seek(self._offsets[i])
+            ans = '    '.join(f.readline().split())+'\n'
+            f.close()
+        else:
+            ans = self.row(i) # Appended or cached; no text to go back to
         return ans
 
+    def writecache(self,cachedir):
+        """ Save the columns and the bookkeeping needed to rebuild this
+        catalog in cachedir, one numpy .npy file per column. The header
+        information is written last, so an interrupted write leaves no
+        usable cache behind. """
+        if os.path.isdir(cachedir):
+            shutil.rmtree(cachedir)
+        os.makedirs(cachedir)
+        for k in self._colnames:
+            N.save(os.path.join(cachedir,k+'.npy'),getattr(self,k))
+        (preserve_case,ncheck) = self.__dict__.get('_options',(False,100))
+        meta = {'key':cachekey(self._fname,preserve_case,ncheck),
+                'projected':self.__dict__.get('_projected',False),
+                'd':self._d,
+                'type':self._type,
+                'fmt':self._fmt,
+                'ncolumns':self._ncolumns,
+                'header':self._header,
+                'colnames':self._colnames}
+        f = open(os.path.join(cachedir,'header.pkl'),'wb')
+        pickle.dump(meta,f,2)
+        f.close()
+
+    def readfixedwidth(self,cfile,preserve_case=False,ncheck=100,
+                       columns=None):
+        """ Fill in this catalog with fixedwidthcatalog. Returns False
+        without doing anything if the catalog is not fixed-width. """
+        ret = fixedwidthcatalog(cfile,preserve_case,ncheck,columns)
+        if ret is None:
+            return False
+        (d,header,ncol,values,types,fmts,offsets) = ret
+        self._d = d
+        self._ncolumns = ncol
+        self._header = header
+        self._fname = cfile
+        self._type = types
+        self._fmt = fmts
+        self._offsets = offsets # For line()
+        self._projected = columns is not None
+        coldict = invert_dict(d)
+        self._colnames = [coldict[k] for k in coldict]
+        for i in range(len(self._colnames)):
+            k = self._colnames[i]
+            newkey = k
+            if hasattr(self,k):
+                #Munge column name if it conflicts
+                newkey='c_'+k
+                print "--Column '%s' read in as '%s' to avoid conflicts"%(k,newkey)
+                self._d[newkey]=self._d[k]
+                del self._d[k]
+                self._colnames[i] = newkey
+            setattr(self,newkey,values[k])
+        return True
+
+    def readcache(self,cfile,cachedir,columns=None,preserve_case=False,
+                  ncheck=100):
+        """ Fill in this catalog from the sidecar written by writecache.
+        The columns are memory-mapped (copy-on-write), so they are only
+        read from disk as they are used. columns selects some of the
+        cached columns, as in se_catalog. Returns False without doing
+        anything if there is no cache, if it is out of date or was read
+        with other preserve_case or ncheck options, or if it does not
+        hold all the columns wanted. """
+        metafile = os.path.join(cachedir,'header.pkl')
+        if not os.path.isfile(metafile):
+            return False
+        f = open(metafile,'rb')
+        try:
+            meta = pickle.load(f)
+        except Exception:
+            return False
+        finally:
+            f.close()
+        if meta.get('key') != cachekey(cfile,preserve_case,ncheck):
+            return False
+        if columns is None:
+            if meta.get('projected'):
+                return False
+            self._d = meta['d']
+        else:
+            try:
+                self._d = selectcolumns(meta['d'],columns)
+            except ValueError:
+                return False
+        self._projected = columns is not None or meta.get('projected')
+        self._type = meta['type']
+        self._fmt = meta['fmt']
+        self._ncolumns = meta['ncolumns']
+        self._header = meta['header']
+        self._colnames = [k for k in meta['colnames'] if k in self._d]
+        self._fname = cfile
+        for k in self._colnames:
+            setattr(self,k,N.load(os.path.join(cachedir,k+'.npy'),
+                                  mmap_mode='c'))
+        return True
+
     def buildheader(self):
         """ Reconstruct the header from the header dictionary.
         This might be useful if only a few columns were selected
@@ -143,15 +362,7 @@ class se_catalog(object):
         
     def gettypes(self,nrows):
         """ Figure out the type & format of each column from up to 100 rows """
-        self._type = {}
-        self._fmt = {}
-        n  = len(self._l)
-        step = max(1,n/nrows)
-        for k in self._d.keys():
-           ret = extract_column(self._d[k],self._l[:n:step]) # skip rows for speed
-           fmt,tp,t = type_and_fmt(ret)
-           self._type[k] = t
-           self._fmt[k] = fmt
+        self._type,self._fmt = columntypes(self._d,self._l,nrows)
            
     def addcolumn(self, colname, coldata, fmt, comment=""):
         """ coldata must be a 1d numarray of the correct length"""
@@ -181,6 +392,110 @@ class se_catalog(object):
         self._d[colname]=self._ncolumns
         self._colnames.append(colname)
         self._header += '# %d %s   %s\n'%(self._ncolumns,colname,comment)
+        self.resetskyindex(colname)
+
+    def appendrows(self,newrows):
+        """ Add rows to the end of the catalog. newrows is a dictionary
+        of arrays keyed by column name, or another se_catalog, with
+        values for every column. The columns are kept in buffers that
+        double in size when they fill up, so adding a few rows at a time
+        does not copy the whole catalog each time. """
+        if isinstance(newrows,se_catalog):
+            newrows = dict([(k,getattr(newrows,k)) for k in self._colnames])
+        missing = [k for k in self._colnames if k not in newrows]
+        if missing:
+            raise ValueError, "No values for columns: %s" % ', '.join(missing)
+        values = dict([(k,N.atleast_1d(N.asarray(newrows[k])))
+                       for k in self._colnames])
+        lengths = set([len(values[k]) for k in self._colnames])
+        if len(lengths) > 1:
+            raise ValueError, "New columns must all be the same length"
+        m = lengths.pop()
+        if m == 0:
+            return
+        n = len(self)
+        if not hasattr(self,'_buffers'):
+            self._buffers = {} # Column name: (buffer, column view of it)
+        for k in self._colnames:
+            col = getattr(self,k)
+            dtype = appendtype(col.dtype,values[k])
+            buf,view = self._buffers.get(k,(None,None))
+            if view is not col or buf.dtype != dtype or len(buf) < n+m:
+                buf = N.empty((max(n+m,2*n),),dtype)
+                buf[:n] = col
+            buf[n:n+m] = values[k]
+            view = buf[:n+m]
+            setattr(self,k,view)
+            self._buffers[k] = (buf,view)
+            if dtype.kind == 'f' and self._type.get(k) == 'd':
+                self._type[k] = 'f'
+                # An integer format would drop the fractions
+                fmt = floatformat(values[k])
+                self._fmt[k] = mergeformats([self._fmt[k],fmt]) or fmt
+
+    def vector(self,name):
+        """ Return the columns of a SExtractor vector parameter, e.g.
+        FLUX_APER, as one contiguous (nrows,n) array. The first call
+        stacks the columns; after that the flattened columns (flux_aper,
+        flux_aper_1, ...) are views into the array, so it is returned
+        again without copying unless one of them has been replaced. """
+        names = vectorcolumns(self._d).get(name)
+        if names is None:
+            raise ValueError, "%s is not a vector column" % name
+        if not hasattr(self,'_vectordata'):
+            self._vectordata = {}
+        block = self._vectordata.get(name)
+        cols = [getattr(self,k) for k in names]
+        stale = [col for col in cols if block is None or
+                 col.base is not block or len(col) != len(block)]
+        if stale:
+            block = N.column_stack(cols)
+            for i in range(len(names)):
+                setattr(self,names[i],block[:,i])
+            self._vectordata[name] = block
+        return block
+
+    def getskyindex(self,racol='alpha_j2000',deccol='delta_j2000'):
+        """ Return a zoneindex of the positions in columns racol and
+        deccol (in degrees), building it the first time it is needed.
+        The index is rebuilt if either column has been replaced or has
+        changed length since. Call resetskyindex() after changing
+        positions in place. """
+        if not hasattr(self,'_skyindices'):
+            self._skyindices = {}
+        ra = getattr(self,racol)
+        dec = getattr(self,deccol)
+        key = (racol,deccol)
+        index = self._skyindices.get(key)
+        # Keep the columns themselves: an id() can be reused once the
+        # old column has been freed
+        if (index is None or index.source[0] is not ra or
+            index.source[1] is not dec or index.source[2] != len(ra)):
+            index = zoneindex(ra,dec)
+            index.source = (ra,dec,len(ra))
+            self._skyindices[key] = index
+        return index
+
+    def resetskyindex(self,colname=None):
+        """ Forget the sky indices that use column colname (default all
+        of them), so that they are rebuilt when next needed. """
+        if not hasattr(self,'_skyindices'):
+            return
+        for key in self._skyindices.keys():
+            if colname is None or colname in key:
+                del self._skyindices[key]
+
+    def conesearch(self,ra,dec,radius,racol='alpha_j2000',
+                   deccol='delta_j2000'):
+        """ Find the rows within radius arcsec of each position (ra,dec)
+        in degrees. ra and dec can be arrays, in which case a list of
+        arrays of row numbers is returned, one per position. """
+        return self.getskyindex(racol,deccol).cone(ra,dec,radius)
+
+    def nearest(self,ra,dec,racol='alpha_j2000',deccol='delta_j2000'):
+        """ Find the row closest to each position (ra,dec) in degrees.
+        Returns the row numbers and the separations in arcsec. """
+        return self.getskyindex(racol,deccol).nearest(ra,dec)
 
     def row(self,rownum):
         """ Construct a new row to be printed out """
@@ -192,24 +507,120 @@ class se_catalog(object):
         line += '\n'
         return line
 
-    def writeto(self,outname,clobber=False):
-        if not clobber:
+    def writeheader(self,fh,columns=None):
+        """ Write the header for the given columns (default all of them)
+        to an open file handle. The header as read in is used unless
+        only some of the catalog's columns are being written. """
+        if columns is None and not self.__dict__.get('_projected'):
+            fh.write(self._header)
+        else:
+            if columns is None:
+                columns = self._colnames
+            writeheader(fh,[c.upper() for c in columns])
+
+    def writerows(self,fh,columns=None,rows=None,blocksize=10000):
+        """ Write rows of the catalog to an open file handle, formatting
+        a block of rows at a time. The output is the same as writing
+        row() for each row.
+        columns -- list of column names to write (default all of them)
+        rows -- boolean mask or array of row numbers (default all rows)
+        """
+        if columns is None:
+            columns = self._colnames
+        rowfmt = ' '.join([self._fmt[c] for c in columns])+' \n'
+        data = [getattr(self,c) for c in columns]
+        # %s and %r print numpy scalars differently from python numbers
+        # (a float32 0.1 is 0.1, not 0.10000000149), so as in row()
+        # those columns keep their numpy scalars
+        keep = [self._fmt[c][-1] in 'sr' and col.dtype.kind not in 'SU'
+                for (c,col) in zip(columns,data)]
+        if rows is None:
+            nrows = len(self)
+        else:
+            rows = N.asarray(rows)
+            if rows.dtype == N.bool_:
+                rows = N.nonzero(rows)[0]
+            nrows = len(rows)
+        for start in range(0,nrows,blocksize):
+            if rows is None:
+                index = slice(start,start+blocksize)
+            else:
+                index = rows[start:start+blocksize]
+            block = []
+            for i in range(len(data)):
+                if keep[i]:
+                    block.append(list(data[i][index]))
+                else:
+                    block.append(data[i][index].tolist())
+            block = zip(*block)
+            fh.write(''.join([rowfmt % r for r in block]))
+
+    def writeto(self,outname,clobber=False,columns=None,rows=None,
+                append=False):
+        """ Write the catalog to a file. columns and rows select a subset
+        of the catalog, as for writerows; if columns is given, a new
+        header is written for just those columns. append=True adds the
+        rows to the end of an existing catalog file instead, after
+        checking that it has the same columns (see checkappend); an empty
+        file gets a header first, as with catalogwriter. """
+        if append and os.path.isfile(outname) and os.path.getsize(outname) > 0:
+            self.checkappend(outname,columns)
+            out=open(outname,'a',1<<20)
+            self.writerows(out,columns=columns,rows=rows)
+            out.close()
+            return
+        if not clobber and not append:
             if os.path.isfile(outname):
                 raise ValueError, """File already exists.
                    Use .writeto(fname, clobber=True) to overwrite. """
 
-        out=open(outname,'w')
+        out=open(outname,'w',1<<20)
 
-        out.write(self._header)
-        for k in range(len(self)):
-            out.write(self.row(k))
+        self.writeheader(out,columns)
+        self.writerows(out,columns=columns,rows=rows)
         out.close()
 
-    def printme(self):
+    def checkappend(self,fname,columns=None):
+        """ Check that rows of this catalog (or of the given columns) can
+        go on the end of the catalog file fname. Its header must list the
+        same columns, and its first row must come out the same when it
+        is printed with this catalog's formats. Raises ValueError if not.
+        """
+        f = open(fname,'r')
+        (d,header,line) = readheader(f)
+        f.seek(0,2)
+        if f.tell() > 0:
+            f.seek(-1,2)
+            if f.read(1) != '\n':
+                f.close()
+                raise ValueError, "%s does not end with a whole line" % fname
+        f.close()
+        ours = cStringIO.StringIO()
+        self.writeheader(ours,columns)
+        ours.seek(0)
+        if readheader(cStringIO.StringIO(header))[0] != readheader(ours)[0]:
+            raise ValueError, "The columns of %s do not match this catalog" % fname
+        if not line:
+            return
+        if columns is None:
+            columns = self._colnames
+        tokens = line.split()
+        convert = {'d':int,'f':float}
+        for i in range(len(columns)):
+            k = columns[i]
+            try:
+                value = convert.get(self._type.get(k),str)(tokens[i])
+                same = (self._fmt[k] % value).strip() == tokens[i]
+            except (ValueError,TypeError,IndexError):
+                same = False
+            if not same:
+                raise ValueError, "Column %s of %s was not written with format '%s'" % (
+                    k,fname,self._fmt[k])
+
+    def printme(self,columns=None,rows=None):
         """ Like writeto, but for sys.stdout """
-        sys.stdout.write(self._header)
-        for k in range(len(self)):
-            sys.stdout.write(self.row(k))
+        self.writeheader(sys.stdout,columns)
+        self.writerows(sys.stdout,columns=columns,rows=rows)
 
 class sextractor(se_catalog): # Just an alias for class se_catalog
     """ Read SExtractor catalog...just an alias for se_catalog """
@@ -217,6 +628,259 @@ class sextractor(se_catalog): # Just an alias for class se_catalog
 class rw_catalog(se_catalog): # Just an alias for class se_catalog
     """ Read SExtractor catalog...just an alias for se_catalog """
     pass
+
+class catalogwriter(object):
+    """ Keep a catalog file open for adding rows, batch after batch.
+        Usage: w = catalogwriter('all.cat',c)
+               w.write(c)               # All of c's rows
+               w.write(c2,rows=good)    # Some rows of another catalog
+               w.close()
+        The header comes from the catalog given when the writer is made.
+        If the file already exists, it is checked with checkappend and
+        the rows are added to the end of it.
+    """
+    def __init__(self,outname,catalog,columns=None,buffersize=1<<22):
+        """ outname -- file to write
+            catalog -- se_catalog with the columns, formats and header
+            columns -- write only these columns (default all of them)
+            buffersize -- size of the output buffer in bytes
+        """
+        self.outname = outname
+        self.columns = columns
+        if os.path.isfile(outname) and os.path.getsize(outname) > 0:
+            catalog.checkappend(outname,columns)
+            self.fh = open(outname,'a',buffersize)
+        else:
+            self.fh = open(outname,'w',buffersize)
+            catalog.writeheader(self.fh,columns)
+
+    def write(self,catalog,rows=None):
+        """ Add rows (a boolean mask or row numbers; default all of them)
+        of an se_catalog with the same columns to the file """
+        catalog.writerows(self.fh,columns=self.columns,rows=rows)
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+class tailcatalog(object):
+    """ Follow a catalog that SExtractor is still writing, reading only
+        the lines completed since the last look. 
+        Usage: t = tailcatalog('live.cat')
+               for chunk in t.follow(interval=5.,timeout=600.):
+                   print len(chunk['number']), 'new sources'
+               c = t.catalog  # An se_catalog of everything read so far
+        or call t.poll() whenever convenient. A partly written last line
+        is left for the next poll. The column types come from the first
+        lines read (up to ncheck of them); callback, if given, is called
+        with each new block of columns.
+    """
+    def __init__(self,catfile,preserve_case=False,ncheck=100,callback=None,
+                 blocksize=1<<26):
+        self.catfile = catfile
+        self.preserve_case = preserve_case
+        self.ncheck = ncheck
+        self.callback = callback
+        self.blocksize = blocksize # Most bytes to read in one poll
+        self.reset()
+
+    def reset(self):
+        """ Start again from the beginning of the file """
+        self.offset = 0      # Where the next unread line starts
+        self.catalog = None
+        self.d = None
+
+    def poll(self):
+        """ Read the lines completed since the last poll and add them to
+        self.catalog. Returns a dictionary of the new columns, or None if
+        there are no new complete lines. """
+        if not os.path.isfile(self.catfile):
+            return None
+        if os.path.getsize(self.catfile) < self.offset:
+            self.reset() # The file has been started over
+        f = open(self.catfile,'r')
+        f.seek(self.offset)
+        text = f.read(self.blocksize)
+        f.close()
+        end = text.rfind('\n')+1 # Leave a partial last line alone
+        if end == 0:
+            return None
+        lines = text[:end].splitlines(True)
+        del text
+        if self.d is None:
+            lines = iter(lines)
+            (d,header,line) = readheader(lines,self.preserve_case)
+            if not line:
+                return None # Only (some of) the header so far
+            lines = [line] + [l for l in lines 
+                              if not l.startswith('#') and l.split()]
+            self.d = d
+            self.header = header
+            self.ncolumns = len(line.split())
+            ncheck = self.ncheck
+            if ncheck == None or ncheck == 'all':
+                ncheck = len(lines)
+            self.types,self.fmts = columntypes(d,lines,ncheck)
+        else:
+            lines = [l for l in lines if not l.startswith('#') and l.split()]
+        if not lines:
+            self.offset += end
+            return None
+        ints = [k for k in self.d if self.types[k] == 'd']
+        columns = convertcolumns(self.d,self.types,lines,self.ncolumns,
+                                 self.fmts)
+        # Only move on once the block has been read, so a block that
+        # fails to convert is tried again in full
+        self.offset += end
+        promoted = [k for k in ints if self.types[k] == 'f']
+        if self.catalog is None:
+            self.catalog = makecatalog(self.d,self.header,self.types,
+                                       self.fmts,columns,self.ncolumns,
+                                       self.catfile)
+        else:
+            self.catalog.appendrows(columns)
+            for k in promoted:
+                self.catalog._fmt[k] = (mergeformats([self.catalog._fmt[k],
+                                        self.fmts[k]]) or self.fmts[k])
+        if self.callback is not None:
+            self.callback(columns)
+        return columns
+
+    def follow(self,interval=1.,timeout=None):
+        """ Generator that polls the catalog every interval seconds and
+        yields each new block of columns. Stops once nothing new has
+        turned up for timeout seconds (default: never). """
+        waited = 0.
+        while True:
+            columns = self.poll()
+            if columns is not None:
+                waited = 0.
+                yield columns
+                continue # There may be more already
+            if timeout is not None and waited >= timeout:
+                return
+            time.sleep(interval)
+            waited += interval
+
+class zoneindex(object):
+    """ Index of positions on the sky, for cone searches and nearest
+        neighbours. The sources are sorted into zones of declination,
+        and by RA within each zone, so a search only looks at the
+        parts of the zones that could overlap the cone. Distances are
+        then checked exactly with unit vectors.
+        Usage: z = zoneindex(ra,dec)  # In degrees
+               rows = z.cone(150.1,2.2,5.)      # Within 5 arcsec
+               rows,sep = z.nearest(ra2,dec2)   # Closest to each one
+    """
+    def __init__(self,ra,dec,zoneheight=None):
+        """ ra, dec -- positions in degrees
+            zoneheight -- height of the zones in degrees. The default
+               puts about sqrt(n) sources in each zone.
+        """
+        ra = N.asarray(ra,dtype=N.float64) % 360.
+        dec = N.asarray(dec,dtype=N.float64)
+        n = len(ra)
+        self.n = n
+        self.decmin = dec.min() if n > 0 else 0.
+        if zoneheight is None:
+            span = dec.max()-self.decmin if n > 0 else 0.
+            zoneheight = max(span/max(1.,N.sqrt(n)),1./3600.)
+        self.zoneheight = zoneheight
+        zone = ((dec-self.decmin)/zoneheight).astype(N.int64)
+        self.nzones = zone.max()+1 if n > 0 else 0
+        self.order = N.lexsort((ra,zone))
+        self.ra = ra[self.order]
+        self.xyz = unitvector(self.ra,dec[self.order])
+        self.starts = N.searchsorted(zone[self.order],
+                                     N.arange(self.nzones+1))
+
+    def candidates(self,ra,dec,radius):
+        """ Positions in sorted order that might be within radius
+        (degrees) of one position, from the RA ranges of the zones """
+        lo = int(N.floor((dec-radius-self.decmin)/self.zoneheight))
+        hi = int(N.floor((dec+radius-self.decmin)/self.zoneheight))
+        lo = max(lo,0)
+        hi = min(hi,self.nzones-1)
+        if abs(dec)+radius >= 90. or radius >= 90.:
+            ranges = [(0.,360.)]  # The cone covers a pole
+        else:
+            dra = N.degrees(N.arcsin(N.sin(N.radians(radius))/
+                                     N.cos(N.radians(dec))))
+            ra = ra % 360.
+            if ra-dra < 0.:
+                ranges = [(0.,ra+dra),(ra-dra+360.,360.)]
+            elif ra+dra > 360.:
+                ranges = [(ra-dra,360.),(0.,ra+dra-360.)]
+            else:
+                ranges = [(ra-dra,ra+dra)]
+        found = []
+        for z in range(lo,hi+1):
+            start = self.starts[z]
+            zra = self.ra[start:self.starts[z+1]]
+            for ralo,rahi in ranges:
+                i = N.searchsorted(zra,ralo,'left')
+                j = N.searchsorted(zra,rahi,'right')
+                if j > i:
+                    found.append(N.arange(start+i,start+j))
+        if found:
+            return N.concatenate(found)
+        return N.array([],dtype=N.int64)
+
+    def cone(self,ra,dec,radius):
+        """ Row numbers of the positions within radius arcsec of (ra,dec)
+        in degrees. If ra and dec are arrays, returns a list of arrays,
+        one for each position. """
+        if N.ndim(ra) > 0:
+            return [self.cone(r,d,radius) for r,d in zip(ra,dec)]
+        radius = radius/3600.
+        cand = self.candidates(ra,dec,radius)
+        chord = 2.*N.sin(N.radians(radius)/2.)
+        d2 = ((self.xyz[cand]-unitvector(ra,dec))**2).sum(1)
+        return N.sort(self.order[cand[d2 <= chord*chord]])
+
+    def nearest(self,ra,dec):
+        """ Row number of the position closest to (ra,dec) in degrees,
+        and the separation in arcsec. If ra and dec are arrays, both
+        are returned as arrays. """
+        if N.ndim(ra) > 0:
+            found = [self.nearest(r,d) for r,d in zip(ra,dec)]
+            return (N.array([f[0] for f in found],dtype=N.int64),
+                    N.array([f[1] for f in found]))
+        if self.n == 0:
+            return -1,N.inf
+        # Widen the search until something turns up; the closest
+        # position inside that cone is the closest of all
+        radius = self.zoneheight
+        while True:
+            cand = self.candidates(ra,dec,min(radius,180.))
+            if len(cand) > 0 or radius >= 180.:
+                d2 = ((self.xyz[cand]-unitvector(ra,dec))**2).sum(1)
+                best = d2.argmin()
+                sep = 2.*N.arcsin(min(1.,N.sqrt(d2[best])/2.))
+                if N.degrees(sep) <= radius or radius >= 180.:
+                    return self.order[cand[best]],N.degrees(sep)*3600.
+            radius = radius*2.
+
+def appendtype(coltype,values):
+  """ The dtype for a column of type coltype that also has to hold
+      values. Integer columns keep their type if the values fit. """
+  if coltype.kind == 'i' and values.dtype.kind in 'iu':
+    info = N.iinfo(coltype)
+    if values.min() >= info.min and values.max() <= info.max:
+      return coltype
+  return N.promote_types(coltype,values.dtype)
+
+def unitvector(ra,dec):
+    """ Unit vectors (x,y,z) for positions in degrees """
+    ra = N.radians(ra)
+    dec = N.radians(dec)
+    cd = N.cos(dec)
+    return N.array([cd*N.cos(ra),cd*N.sin(ra),N.sin(dec)]).T
 def invert_dict(d):
     """ Generate a new dictionary with the key/value relationship inverted """
     newd={}
@@ -224,6 +888,36 @@ def invert_dict(d):
         newd[d[k]]=k
     return newd
 
+def selectcolumns(d,columns):
+  """ Pick out part of a dictionary of column names and numbers.
+      columns is a list of names, or a regular expression matched against
+      the start of each name. Raises ValueError if a name is not in d or
+      if nothing matches. """
+  if isinstance(columns,str):
+    pattern = re.compile(columns)
+    subset = dict([(k,d[k]) for k in d if pattern.match(k)])
+    if len(subset) == 0:
+      raise ValueError, "No columns match '%s'" % columns
+    return subset
+  missing = [k for k in columns if k not in d]
+  if missing:
+    raise ValueError, "No such columns: %s" % ', '.join(missing)
+  return dict([(k,d[k]) for k in columns])
+
+def cachename(catfile):
+  """ Default name of the binary sidecar directory for a catalog """
+  return catfile+'.npcache'
+
+def cachekey(catfile,preserve_case=False,ncheck=100):
+  """ What a cached copy of a catalog must match to be used: the
+      full path to the catalog, its size and its modification time,
+      and the options that change how it is read """
+  st = os.stat(catfile)
+  if ncheck == None:
+    ncheck = 'all'
+  return (os.path.abspath(catfile),st.st_size,st.st_mtime,
+          bool(preserve_case),ncheck)
+
 def parseconfig_se(cfile):
   """ parseconfig -- read a SExtractor .sex file and return a dictionary
     of options & values. Comments are ignored.
@@ -255,60 +949,434 @@ def initcat(catfile,preserve_case=False):
       returns a dictionary of parameter names and column numbers.
       Also returns a list of lines containing the data.
   """
+  f = datalines(catfile)
+  try:
+    (hdict,header,line) = readheader(f,preserve_case=preserve_case)
+    if not line:
+      return (hdict,[],0,header)
+    lines = [line] + list(f)
+  finally:
+    f.close()
+  return (hdict,lines,len(line.split()),header)
+
+def readheader(f,preserve_case=False):
+  """ readheader -- reads the header of a SExtractor catalog from an open
+      file, stopping at the first data line. Returns a dictionary of
+      parameter names and column numbers, the header as a string, and
+      the first data line ('' if the catalog has no sources). The rest
+      of the file is left unread.
+  """
   hdict = {}
-  header=[]
-  f = open(catfile,'r')
-  lines = f.readlines()
+  header = []
+  previous_column = 0
+  previous_key = ""
+  line = ''
+  for l in f:
+    if l.startswith('#'):
+      header.append(l)
+      a = (l.replace('#','# ')).split() #Guard against "#10 colname"
+      try:
+        col = int(a[1])
+        if col != previous_column+1:
+          for c in range(previous_column+1,col):
+            column_name = previous_key+"_%d" % (c-previous_column)
+            hdict[column_name] = c
+        if (preserve_case):
+          column_name = a[2]
+        else:
+          column_name = a[2].lower()
+        hdict[column_name] = col
+        previous_column = col
+        previous_key = column_name
+      except (ValueError, IndexError):
+        pass
+    elif len(l.split()) > 0:
+      line = l
+      break
+  # Check if there are extra columns on the first data line
+  for c in range(previous_column+1,len(line.split())):
+    column_name = previous_key+"_%d" % (c-previous_column)
+    if not preserve_case:
+      column_name = column_name.lower()
+    hdict[column_name] = c
+  return (hdict,''.join(header),line)
+
+def fixedwidthcatalog(catfile,preserve_case=False,ncheck=100,columns=None):
+  """ Read a catalog whose data lines all have the same length, with
+      each column at the same byte positions on every line, without
+      splitting the lines at all. The file is memory-mapped and each
+      column's bytes are handed to numpy's parser as one block. The
+      column positions come from up to ncheck lines spread through the
+      file (see fixedwidthspans), and every line is then checked against
+      them (see fitsspans). columns selects some of the columns,
+      as in se_catalog. Returns (d,header,ncolumns,values,types,fmts,
+      offsets), where values is a dictionary of arrays and offsets has
+      the position of each data line, or None if the layout is not
+      fixed-width (or the file is compressed).
+  """
+  if compression(catfile) != None:
+    return None
+  f = open(catfile,'rb')
+  try:
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+      return None
+    mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+  finally:
+    f.close()
+  (d,header,first) = readheader(iter(mm.readline,''),preserve_case)
+  if not first or not first.endswith('\n'):
+    return None
+  width = len(first)
+  start = mm.tell()-width
+  if (size-start) % width != 0:
+    return None
+  nlines = (size-start)/width
+  data = N.frombuffer(mm,dtype=N.uint8,count=nlines*width,offset=start)
+  data = data.reshape((nlines,width))
+  if not (data[:,-1] == ord('\n')).all():
+    return None
+  if ncheck == None or ncheck == 'all':
+    ncheck = nlines
+  sample = data[::max(1,nlines/ncheck)]
+  spans = fixedwidthspans(sample)
+  if spans is None or len(spans) != len(first.split()):
+    return None
+  # The lines that were not sampled must fit the same layout
+  if not fitsspans(data,spans):
+    return None
+  if columns is not None:
+    d = selectcolumns(d,columns)
+  if max(d.values()) > len(spans):
+    return None
+  types,fmts = columntypes(d,[row.tostring() for row in sample],len(sample))
+  values = {}
+  for k in d:
+    (a,b) = spans[d[k]-1]
+    values[k] = fixedwidthcolumn(data[:,a:b],types[k])
+    if types[k] == 'd' and values[k].dtype == N.float64:
+      types[k] = 'f'
+      cells = N.ascontiguousarray(data[:,a:b]).view('S%d' % (b-a)).ravel()
+      fmts[k] = promotedformat(fmts[k],N.char.strip(cells).tolist())
+  offsets = start+width*N.arange(nlines,dtype=N.int64)
+  return (d,header,len(spans),values,types,fmts,offsets)
+
+def fixedwidthspans(rows):
+  """ Find the columns of fixed-width lines, given as a 2-d array of
+      bytes with one line (ending in a newline) per row. Returns a list
+      of (start,end) byte spans, one per column. Each span starts where
+      the previous column ends, so it includes the blanks in front of
+      its own column. Returns None unless every line has exactly one
+      token in each span. """
+  filled = rows[:,:-1] > ord(' ') # Not whitespace
+  used = filled.any(0)
+  if not used.any():
+    return None
+  edges = N.diff(N.concatenate([[0],used.astype(N.int8),[0]]))
+  ends = N.nonzero(edges == -1)[0]
+  spans = zip(N.concatenate([[0],ends[:-1]]),ends)
+  if not fitsspans(rows,spans):
+    return None
+  return spans
+
+def fitsspans(rows,spans,blocksize=8192):
+  """ True if every line of rows (as for fixedwidthspans) has exactly
+      one token in each of the spans, and nothing after the last one.
+      The lines are checked blocksize at a time. """
+  starts = [a for (a,b) in spans]
+  last = spans[-1][1]
+  for i in range(0,len(rows),blocksize):
+    filled = rows[i:i+blocksize,:-1] > ord(' ') # Not whitespace
+    if filled[:,last:].any():
+      return False
+    # No token may run on from one span into the next
+    for a in starts[1:]:
+      if (filled[:,a-1] & filled[:,a]).any():
+        return False
+    # Where tokens start: at least one in each span, and as many in
+    # all as there are spans, so exactly one in each
+    tokenstarts = filled[:,:last].copy()
+    tokenstarts[:,1:] &= ~filled[:,:last-1]
+    if N.count_nonzero(tokenstarts) != len(tokenstarts)*len(spans):
+      return False
+    if not N.logical_or.reduceat(tokenstarts,starts,axis=1).all():
+      return False
+  return True
+
+def fixedwidthcolumn(field,coltype):
+  """ Convert one column of a fixed-width catalog, given as a 2-d array
+      of bytes (the column's span on each line), to an array of type
+      coltype ('d','f','s'). """
+  nlines,width = field.shape
+  if coltype == 's':
+    values = N.char.strip(N.ascontiguousarray(field).view('S%d' % width).ravel())
+    return values.astype('S%d' % N.char.str_len(values).max())
+  # Make sure there is a blank between one line's value and the next
+  buf = N.empty((nlines,width+1),N.uint8)
+  buf[:,0] = ord(' ')
+  buf[:,1:] = field
+  values = N.fromstring(buf.tostring(),dtype=N.float64,sep=' ')
+  if len(values) != nlines:
+    values = buf.view('S%d' % (width+1)).ravel().astype(N.float64)
+  if coltype == 'd':
+    values = toints(values)
+  return values
+
+def datalines(catfile):
+  """ Generator over the lines of a catalog, which may be compressed
+      with gzip, bzip2 or xz (decompressed as it is read). """
+  if compression(catfile) == None:
+    f = open(catfile,'r')
+    try:
+      for line in f:
+        yield line
+    finally:
+      f.close()
+  else:
+    rest = ''
+    for text in decompress(catfile):
+      lines = (rest+text).split('\n')
+      rest = lines.pop()
+      for line in lines:
+        yield line+'\n'
+    if rest:
+      yield rest
+
+def compression(catfile):
+  """ 'gz', 'bz2' or 'xz' for a compressed file (from its first bytes),
+      otherwise None """
+  f = open(catfile,'rb')
+  magic = f.read(6)
   f.close()
-  first = 1
-  firstdata = 0
-  i = 0
-  previous_column=0
-  previous_key=""
-  for l in lines:
-    if l.startswith('#'): #this is a header line        
-        header.append(l)        
-        a = (l.replace('#','# ')).split() #Guard against "#10 colname"
-        try:
-            col = int(a[1])
-            # If the column numbers skip, create new column names for
-            # columns not named explicitly in the header
-            if col != previous_column+1:
-              for c in range(previous_column+1,col):
-                column_name = previous_key+"_%d" % (c-previous_column)
-                hdict[column_name] = c
-            # Update this column in the dictionary
-            if (preserve_case):
-                column_name = a[2]
-            else:
-                column_name = a[2].lower()
-                hdict[column_name] = col
-            firstdata = i+1
-            previous_column = col
-            previous_key = column_name
-        except (ValueError, IndexError):
-            #it's a comment line with no column number,
-            #or an entirely blank comment line: skip
-            pass
-    
-    else:  # This is where the data start
-        a=string.split(l)
-        if len(a)>0:
-            if first:
-              firstdata = i
-              first = 0
-            # Check if there are extra columns
-            if len(a) > previous_column: 
-            # If so, add keys for the last entry
-              for c in range(previous_column+1,len(a)):
-                column_name = previous_key+"_%d" % (c-previous_column)
-                if (preserve_case):
-                    hdict[column_name] = c
-                else:
-                    hdict[column_name.lower()] = c
-            ncolumns = len(a)
-    i = i+1
-  return(hdict,lines[firstdata:],ncolumns,''.join(header))
+  if magic[:2] == '\x1f\x8b':
+    return 'gz'
+  elif magic[:3] == 'BZh':
+    return 'bz2'
+  elif magic == '\xfd7zXZ\x00':
+    return 'xz'
+  return None
+
+def decompressor(kind):
+  if kind == 'gz':
+    return zlib.decompressobj(16+zlib.MAX_WBITS)
+  elif kind == 'bz2':
+    return bz2.BZ2Decompressor()
+  elif lzma == None:
+    raise IOError, "The lzma module is needed to read .xz catalogs"
+  return lzma.LZMADecompressor()
+
+def decompress(catfile,blocksize=1<<20):
+  """ Generator over blocks of text from a compressed catalog, including
+      every stream of multi-stream files (e.g. concatenated gzip files) """
+  kind = compression(catfile)
+  f = open(catfile,'rb')
+  try:
+    d = decompressor(kind)
+    data = f.read(blocksize)
+    while data:
+      try:
+        text = d.decompress(data)
+      except EOFError: # The previous stream has ended
+        d = decompressor(kind)
+        continue
+      if text:
+        yield text
+      if d.unused_data:
+        data = d.unused_data
+        d = decompressor(kind)
+      else:
+        data = f.read(blocksize)
+  finally:
+    f.close()
+
+def readrows(f,nrows):
+  """ Read up to nrows data lines from an open catalog file,
+      skipping comments and blank lines. """
+  lines = []
+  if nrows <= 0:
+    return lines
+  for l in f:
+    if l.startswith('#') or len(l.split()) == 0:
+      continue
+    lines.append(l)
+    if len(lines) == nrows:
+      break
+  return lines
+
+def iterchunks(catfile,nrows=100000,preserve_case=False,ncheck=100):
+  """ Read a SExtractor catalog in blocks of nrows rows, for catalogs
+      too large to hold in memory. The header is parsed once, and the
+      column types are determined from (up to ncheck rows of) the first
+      block. Yields a dictionary of arrays, keyed by column name,
+      for each block. For example:
+         nbright = 0
+         for chunk in iterchunks('big.cat',nrows=500000):
+             nbright += (chunk['mag_auto'] < 20.).sum()
+      If a later block has non-integer values in a column that looked
+      like integers, that column is returned as floats from then on.
+  """
+  f = datalines(catfile)
+  try:
+    (d,header,line) = readheader(f,preserve_case=preserve_case)
+    if not line:
+      return
+    ncol = len(line.split())
+    lines = [line] + readrows(f,nrows-1)
+    if ncheck == None or ncheck == 'all':
+      ncheck = len(lines)
+    types,fmts = columntypes(d,lines,ncheck)
+    while lines:
+      yield convertcolumns(d,types,lines,ncol)
+      lines = readrows(f,nrows)
+  finally:
+    f.close()
+
+def vectorcolumns(d):
+  """ Find the SExtractor vector parameters in a dictionary of column
+      names and numbers from initcat: columns such as flux_aper followed
+      by flux_aper_1, flux_aper_2... in the next column numbers, which
+      initcat made up for the columns missing from the header. Returns
+      a dictionary of the names of each vector's columns, in order. """
+  vectors = {}
+  for k in d:
+    names = [k]
+    while d.get(k+"_%d" % len(names)) == d[k]+len(names):
+      names.append(k+"_%d" % len(names))
+    if len(names) > 1:
+      vectors[k] = names
+  return vectors
+
+def makecatalog(d,header,types,fmts,columns,ncolumns,fname=None):
+  """ Make an se_catalog from columns that have already been read, e.g.
+      by iterchunks or tailcatalog. d, types and fmts are dictionaries
+      keyed by column name, like the _d, _type and _fmt attributes. """
+  c = se_catalog.__new__(se_catalog)
+  c._d = dict(d)
+  c._ncolumns = ncolumns
+  c._header = header
+  c._fname = fname
+  coldict = invert_dict(c._d)
+  c._colnames = [coldict[k] for k in coldict]
+  c._type = dict(types)
+  c._fmt = dict(fmts)
+  for k in c._colnames:
+    setattr(c,k,columns[k])
+  return c
+
+def readcatalog(catfile,**keywords):
+  """ Read one catalog for loadcatalogs, without the split lines that
+      would otherwise be sent back from the worker process """
+  c = se_catalog(catfile,**keywords)
+  if hasattr(c,'_colentries'):
+    del c._colentries
+  return c
+
+def loadcatalogs(files,nproc=None,chunksize=1,**keywords):
+  """ Read a list of SExtractor catalogs, e.g. one per tile of a survey,
+      in parallel and return them as a single se_catalog.
+      files -- list of catalog names, or a glob pattern ('tile*.cat')
+      nproc -- number of worker processes (default: one per cpu)
+      chunksize -- number of catalogs handed to a worker at a time
+      Other keywords (preserve_case, ncheck...) are passed to se_catalog.
+      The catalogs must all have the same columns. A tile_id column is
+      added, giving the position in c._files of the catalog that each
+      row came from.
+  """
+  if isinstance(files,str):
+    files = sorted(glob.glob(files))
+  files = list(files)
+  if len(files) == 0:
+    raise ValueError, "No catalogs to read"
+  reader = functools.partial(readcatalog,**keywords)
+  if nproc == 1:
+    catalogs = map(reader,files)
+  else:
+    pool = multiprocessing.Pool(nproc)
+    try:
+      catalogs = pool.map(reader,files,chunksize)
+    finally:
+      pool.close()
+      pool.join()
+  return concatcatalogs(catalogs,files)
+
+def concatcatalogs(catalogs,names):
+  """ Join se_catalogs with the same columns end to end, adding a tile_id
+      column with each row's position in the list. Returns the first
+      catalog, extended in place. names are used in error messages and
+      saved as the _files attribute. """
+  c = catalogs[0]
+  for name,other in zip(names[1:],catalogs[1:]):
+    if other._d != c._d:
+      diff = set(other._d.items()) ^ set(c._d.items())
+      raise ValueError, "Columns of %s do not match %s: %s" % (name,
+            names[0],', '.join(sorted(set([k for k,col in diff]))))
+  lengths = [len(o) for o in catalogs]
+  # Catalogs with no sources have float arrays and made-up types, so
+  # they are left out
+  full = [o for o in catalogs if len(o) > 0] or catalogs[:1]
+  for k in c._colnames:
+    setattr(c,k,N.concatenate([getattr(o,k) for o in full]))
+    # Ints in one catalog and floats in another end up as floats
+    for t in ['s','f','d']:
+      matching = [o for o in full if o._type[k] == t]
+      if matching:
+        c._type[k] = t
+        # Wide and precise enough for the values of every catalog
+        fmt = mergeformats([o._fmt[k] for o in full])
+        if fmt is None:
+          fmt = matching[0]._fmt[k]
+        c._fmt[k] = fmt
+        break
+  # The text of the first catalog no longer matches the columns
+  for attr in ['_colentries','_l','_pending']:
+    if attr in c.__dict__:
+      delattr(c,attr)
+  tile_id = N.repeat(N.arange(len(catalogs),dtype=N.int32),lengths)
+  c.addcolumn('tile_id',tile_id,'%%%dd' % len(str(len(catalogs)-1)),
+              'Position of the source catalog in _files')
+  c._files = list(names)
+  return c
+
+def columntypes(d,lines,nrows):
+  """ Figure out the type & format of each column from up to nrows lines.
+      Returns dictionaries of types ('d','f','s') and print formats,
+      keyed by column name. """
+  types = {}
+  fmts = {}
+  n  = len(lines)
+  step = max(1,n/nrows)
+  # Split each sampled line once, as far as the last column wanted,
+  # and turn the rows into columns
+  maxcol = max(d.values()+[0])
+  rows = [l.split(None,maxcol)[:maxcol] for l in lines[:n:step]] # skip rows for speed
+  if len(set(map(len,rows))) == 1:
+    columns = zip(*rows)
+  else:
+    columns = None
+  for k in d.keys():
+     i = d[k]-1
+     if columns is not None and i < len(columns):
+       ret = columns[i]
+     else:
+       ret = [a[i] for a in rows]
+     fmt,tp,t = columnformat(ret)
+     types[k] = t
+     fmts[k] = fmt
+  return types,fmts
+
+def getcolumn(col,coltype,lines):
+  """ Get a single column straight from the data lines of a catalog,
+      splitting each line only as far as that column. Returns an array
+      of the given type ('d','f','s'). """
+  i = col-1
+  if len(lines) == 0:
+    return N.array([])
+  values = N.array([l.split(None,i+1)[i] for l in lines])
+  if coltype == 'd':
+    return toints(values)
+  if coltype == 'f':
+    return values.astype(N.float64)
+  return values
 
 def getcolvalues(col,coltype,colentries):
   """ Get a column from a SExtractor catalog. Determine the type
@@ -338,6 +1406,88 @@ def getcolvalues(col,coltype,colentries):
           values[j] = int(colentries[j][i])
   return values
 
+def convertcolumns(d,types,lines,ncolumns,fmts=None):
+  """ Convert all the columns of a SExtractor catalog at once.
+      The data lines are joined and tokenized in a single pass, and
+      each column is then converted in bulk by numpy into an array of
+      the type given by gettypes (Int32, Float64 or strings). If d only
+      asks for the first few columns, each line is split only as far
+      as the last of them.
+      Returns a dictionary of arrays keyed by column name. Falls back
+      to getcolvalues if the rows do not all have ncolumns entries.
+      Integer columns that turn out to hold non-integer values are
+      promoted to floats, and types (and fmts, if given) are updated
+      to match.
+  """
+  nlines = len(lines)
+  if nlines == 0 or len(d) == 0:
+    return dict([(k,N.array([])) for k in d])
+  maxcol = max(d.values())
+  table = None
+  if 2*maxcol <= ncolumns:
+    # Only the first few columns are wanted: stop splitting there
+    try:
+      table = N.array([l.split(None,maxcol)[:maxcol] for l in lines])
+    except ValueError:
+      pass
+    if table is not None and table.shape != (nlines,maxcol):
+      table = None
+  if table is None:
+    text = ''.join(lines)
+    ntot = nlines*ncolumns
+    if 's' not in [types[k] for k in d]:
+      # All numeric: let numpy parse the text directly
+      try:
+        values = N.fromstring(text,dtype=N.float64,sep=' ')
+      except ValueError:
+        values = []
+      if len(values) == ntot:
+        table = values.reshape((nlines,ncolumns))
+      del values
+    if table is None:
+      tokens = text.split()
+      if len(tokens) == ntot:
+        table = N.array(tokens).reshape((nlines,ncolumns))
+      del tokens
+    del text
+  columns = {}
+  if table is None: # Ragged rows; convert them one at a time
+    colentries = [l.split() for l in lines]
+    for k in d:
+      columns[k] = getcolvalues(d[k],types[k],colentries)
+    return columns
+  for k in d:
+    values = table[:,d[k]-1]
+    if types[k] == 'd':
+      values = toints(values)
+      if values.dtype == N.float64:
+        types[k] = 'f'
+        if fmts is not None:
+          fmts[k] = promotedformat(fmts[k],extract_column(d[k],lines))
+    elif types[k] == 'f':
+      values = values.astype(N.float64) # Also makes a contiguous copy
+    else:
+      values = values.astype('S%d' % N.char.str_len(values).max())
+    columns[k] = values
+  return columns
+
+def toints(values):
+  """ Convert an array of numbers or numeric strings to Int32, or to
+      Float64 if they are not all integers. """
+  if values.dtype.kind in 'SU':
+    # Casting strings straight to Int32 can give garbage instead of
+    # raising ValueError, so go through Float64 (which does raise)
+    fvalues = values.astype(N.float64)
+    if not N.char.isdigit(N.char.lstrip(values,'+-')).all():
+      return fvalues
+    values = fvalues
+  if len(values) > 0 and not N.abs(values).max() <= 2147483647:
+    return values.astype(N.float64) # NaN, or too big for Int32
+  ivalues = values.astype(N.int32)
+  if N.any(ivalues != values):
+    return values.astype(N.float64)
+  return ivalues
+
 def writeheader(fh,colnames):
     """ Write an SExtractor-style header to an open file handle.
 
@@ -417,6 +1567,146 @@ def type_and_fmt(stringlist):
         fmt_type = 'f'
     return (outfmt, var_type,fmt_type)
         
+intcolumn = re.compile(r'(?:[+-]?\d+\n)*[+-]?\d+\Z')
+numberpattern = re.compile(r'[+-]?(?=\.?\d)\d*(\.\d*)?([eE][+-]?\d+)?\Z')
+nonfinitepattern = re.compile(r'[+-]?(?:nan|inf|infinity)\Z',re.I)
+
+def numberformat(cells,values):
+    """ The type and format for a character array of numbers and their
+        (finite) values, worked out with array operations on the bytes
+        of the strings rather than one string at a time. """
+    chars = cells.view(N.uint8).reshape((len(cells),-1))
+    lengths = (chars != 0).sum(1)
+    isdot = chars == ord('.')
+    dot = N.where(isdot.any(1),isdot.argmax(1),-1)
+    ise = (chars == ord('e')) | (chars == ord('E'))
+    isexp = ise.any(1)
+    isfloat = (dot >= 0) & ~isexp
+    # Digits after the decimal point, up to the exponent
+    end = N.where(isexp,ise.argmax(1),lengths)
+    precisions = N.where(dot >= 0,end-dot-1,0)
+    if isexp.any():
+        length = lengths[N.nonzero(isexp)[0][-1]] # From the last one
+        precision = precisions[isexp].max()
+        return ("%%%d.%de" % (length+2,precision), type(1.2), 'f')
+    if not isfloat.any():
+        return ("%%%dd" % lengths.max(), type(''), 'd')
+    floatcells = N.nonzero(isfloat)[0]
+    first = floatcells[0]
+    last = floatcells[-1]
+    values = values[isfloat]
+    floatlen = max(lengths[:first].max() if first > 0 else 0,
+                   len(str(int(values.max()))),len(str(int(values.min()))))
+    precision = precisions[isfloat].max()
+    length = max(floatlen+precision+1,lengths[last])
+    return ("%%%d.%df" % (length,precision), type(1.2), 'f')
+
+def columnformat(cells):
+    """ Determine the type and format of a list of strings.
+        Gives the same answer as type_and_fmt, but matches compiled
+        patterns against the cells instead of making a fmt object
+        for each one, and checks columns of integers all at once.
+    """
+    if len(cells) == 0:
+        return type_and_fmt(cells)
+    if intcolumn.match('\n'.join(cells)):
+        return ("%%%dd" % max(map(len,cells)), type(''), 'd')
+    # Columns of ordinary numbers can be done with array operations
+    cells_array = N.array(cells)
+    try:
+        values = cells_array.astype(N.float64)
+    except ValueError:
+        values = None
+    if values is not None and N.isfinite(values).all():
+        return numberformat(cells_array,values)
+    lengths = [len(c) for c in cells]
+    matches = [numberpattern.match(c) for c in cells]
+    for c,m in zip(cells,matches):
+        if m is None and not nonfinitepattern.match(c):
+            return ("%%%ds" % max(lengths), type(''), 's')
+    # Digits after the decimal point (from the '.ddd' group)
+    precisions = [0]*len(cells)
+    for i,m in enumerate(matches):
+        if m is not None and m.group(1):
+            precisions[i] = len(m.group(1))-1
+    # Exponential format: the length comes from the last one
+    ecells = [i for i,m in enumerate(matches) if m is not None and m.group(2)]
+    if ecells:
+        length = lengths[ecells[-1]]
+        precision = max([precisions[i] for i in ecells])
+        return ("%%%d.%de" % (length+2,precision), type(1.2), 'f')
+    # Floats, including NaN and Inf (m is None)
+    fcells = [i for i,m in enumerate(matches) if m is None or m.group(1)]
+    values = N.array([float(cells[i]) for i in fcells])
+    finite = N.isfinite(values)
+    if not finite.any():
+        length = max([lengths[i] for i,m in enumerate(matches) 
+                      if m is not None and not m.group(1)] + [0])
+        return ("%%%dd" % length, type(''), 'd')
+    finitecells = [fcells[i] for i in N.nonzero(finite)[0]]
+    first = finitecells[0]
+    last = finitecells[-1]
+    # Ints before the first float set the minimum number of digits
+    floatlen = max([lengths[i] for i in range(first)
+                    if matches[i] is not None and not matches[i].group(1)]
+                   + [0])
+    v = values[finite]
+    floatlen = max(floatlen,len(str(int(v.max()))),len(str(int(v.min()))))
+    precision = max([precisions[i] for i in fcells if i >= first])
+    length = max(floatlen+precision+1,lengths[last])
+    # NaN or Inf after the last float can still widen the column
+    for i in fcells:
+        if i > last:
+            length = max(length,lengths[i])
+    return ("%%%d.%df" % (length,precision), type(1.2), 'f')
+
+def promotedformat(fmt,cells):
+    """ The format for a column printed with integer format fmt that has
+        turned out to hold non-integers, worked out from the text of its
+        cells, so that writing it out does not drop the fractions. """
+    new = columnformat(cells)[0]
+    return mergeformats([fmt,new]) or new
+
+def floatformat(values):
+    """ A %f format wide enough for an array of numbers, with enough
+        digits after the decimal point (up to 15) to print each of them
+        without rounding. """
+    v = N.asarray(values,N.float64)
+    v = v[N.isfinite(v)]
+    if len(v) == 0:
+        return "%3.0f"
+    precision = 15
+    for p in range(16):
+        if (N.round(v,p) == v).all():
+            precision = p
+            break
+    intlen = max(len(str(int(v.max()))),len(str(int(v.min()))))
+    return "%%%d.%df" % (intlen+precision+1,precision)
+
+formatpattern = re.compile(r'%(\d*)(?:\.(\d+))?([dfes])\Z')
+
+def mergeformats(fmts):
+    """ One print format wide and precise enough for every column
+        formatted with one of fmts (from columnformat): the widest
+        integer part and the most digits after the decimal point.
+        Returns None if one of the formats is not of that kind. """
+    matches = [formatpattern.match(f) for f in fmts]
+    if len(matches) == 0 or [m for m in matches if m is None]:
+        return None
+    widths = [int(m.group(1) or 0) for m in matches]
+    precisions = [int(m.group(2) or 0) for m in matches]
+    kinds = [m.group(3) for m in matches]
+    if 's' in kinds:
+        return "%%%ds" % max(widths)
+    if 'e' in kinds:
+        return "%%%d.%de" % (max(widths),max(precisions))
+    if 'f' in kinds:
+        precision = max([p for p,t in zip(precisions,kinds) if t == 'f'])
+        intlen = max([w-p-1 if t == 'f' else w
+                      for w,p,t in zip(widths,precisions,kinds)])
+        return "%%%d.%df" % (intlen+precision+1,precision)
+    return "%%%dd" % max(widths)
+
 class fmt:
     """ Determine the format of a string 
         fmt.fmt = the format sfor printing the string
@@ -463,9 +1753,5 @@ class fmt:
 
 def extract_column(col,lines):
     """ Extract a column from a bunch of rows """
-    ret = []
     i = col-1
-    for l in lines:
-       a = string.split(l)[i]
-       ret = ret + [a]
-    return ret
+    return [l.split(None,col)[i] for l in lines]
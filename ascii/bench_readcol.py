@@ -0,0 +1,199 @@
+# Benchmarks for readcol_ferguson.py
+#
+# Writes a synthetic whitespace-delimited table to a temporary file and
+# times the different ways of reading it.
+#
+# Usage: python bench_readcol.py [nrows] [ncolumns]
+
+import os, sys
+import tempfile
+import time
+import struct
+import zlib
+import gzip
+import bz2
+import numpy as N
+
+import readcol_ferguson as rc
+
+def maketable(fname,nrows,ncolumns,seed=42,strings=True):
+    """ Write a table with an integer id column, a string column (unless
+        strings is False) and float columns.
+    """
+    rng = N.random.RandomState(seed)
+    out = open(fname,'w')
+    out.write('# synthetic table\n')
+    nstrings = int(strings)
+    fmt = '%10d' + ' %8s'*nstrings + \
+          ''.join([' %10.4f']*(ncolumns-1-nstrings)) + '\n'
+    block = 10000
+    for start in range(0,nrows,block):
+        n = min(block,nrows-start)
+        data = [N.arange(start+1,start+n+1)]
+        if strings:
+            data.append(['obj%d' % i for i in range(start+1,start+n+1)])
+        for c in range(1+nstrings,ncolumns):
+            data.append(rng.uniform(0.,1000.,n))
+        for row in zip(*data):
+            out.write(fmt % row)
+    out.close()
+
+def timeit(label,func,*args,**keywords):
+    t0 = time.time()
+    ret = func(*args,**keywords)
+    dt = time.time()-t0
+    print "%-40s %8.3f s" % (label,dt)
+    return ret,dt
+
+def legacy_fgetcols(fname,*args):
+    """ One getcol (and one split of every line) per column, as
+        fgetcols used to.
+    """
+    l = rc.readlines(fname)
+    ncols = len(args)
+    colnumbers = args
+    if ncols == 0:
+        ncols = len(l[0].split())
+        colnumbers = range(1,ncols+1)
+    return [rc.getcol(c,l,N) for c in colnumbers]
+
+def bench_fgetcols(fname):
+    old,told = timeit("getcol per column, all columns",legacy_fgetcols,fname)
+    new,tnew = timeit("fgetcols, all columns",rc.fgetcols,fname)
+    for a,b in zip(old,new):
+        assert a.dtype == b.dtype and N.all(a == b)
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def legacy_readlines(fname,indef):
+    """ Comment removal by popping from the list and INDEF replacement by
+        repeated find, as readcol used to.
+    """
+    l = open(fname,'r').readlines()
+    comments = []
+    for i in range(len(l)):
+        l[i] = l[i].strip()
+        if l[i] == '' or l[i][0] == '#':
+            comments = comments + [i]
+    ngone = 0
+    for i in comments:
+        comment = l.pop(i-ngone)
+        ngone = ngone+1
+    for i in range(len(l)):
+        while l[i].find("INDEF") > -1:
+            idx = l[i].find("INDEF")
+            l[i] = l[i][:idx]+indef+l[i][idx+5:]
+    return l
+
+def bench_filter(fname,nrows):
+    """ Same table with a comment line after every data line and some
+        INDEF values.
+    """
+    commented = fname+'.cmt'
+    out = open(commented,'w')
+    for i,line in enumerate(open(fname,'r')):
+        if i % 7 == 3:
+            line = line.replace(' ',' INDEF ',1)
+        out.write(line)
+        out.write('# comment %d\n' % i)
+    out.close()
+    try:
+        old,told = timeit("pop comments, find INDEF",
+                          legacy_readlines,commented,'-99.99')
+        new,tnew = timeit("filterlines",rc.readlines,commented,
+                          indef='-99.99')
+        assert old == new
+        print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+    finally:
+        os.remove(commented)
+
+def read_all(fname,ncolumns,memmap):
+    f = rc.readcol(fname,memmap=memmap)
+    return f,f.getcols(*range(1,ncolumns+1))
+
+def bench_memmap(fname,nrows,ncolumns):
+    numeric = fname+'.num'
+    maketable(numeric,nrows,ncolumns,strings=False)
+    try:
+        (f,old),told = timeit("readcol, all columns",
+                              read_all,numeric,ncolumns,False)
+        (f,new),tnew = timeit("readcol(memmap=True), all columns",
+                              read_all,numeric,ncolumns,True)
+        for a,b in zip(old,new):
+            assert a.dtype == b.dtype and N.all(a == b)
+        print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+        x,tagain = timeit("  getcols again on the same object",
+                          f.getcols,1,2)
+        f.close()
+    finally:
+        os.remove(numeric)
+
+def bench_parallel(fname,nproc=None):
+    old,told = timeit("fgetcols, all columns",rc.fgetcols,fname)
+    new,tnew = timeit("pfgetcols, all columns",rc.pfgetcols,fname,
+                      nproc=nproc)
+    for a,b in zip(old,new):
+        assert a.dtype == b.dtype and N.all(a == b)
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def bgzip(fname,outname,blocksize=1<<16):
+    """ Write a gzip file made of independent members that record their
+        own size (the BGZF layout written by bgzip).
+    """
+    data = open(fname,'rb').read()
+    out = open(outname,'wb')
+    for i in range(0,len(data),blocksize-1024):
+        block = data[i:i+blocksize-1024]
+        c = zlib.compressobj(6,zlib.DEFLATED,-zlib.MAX_WBITS)
+        cdata = c.compress(block)+c.flush()
+        out.write('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff')
+        out.write(struct.pack('<HccHH',6,'B','C',2,len(cdata)+25))
+        out.write(cdata)
+        out.write(struct.pack('<II',zlib.crc32(block) & 0xffffffff,
+                              len(block)))
+    out.close()
+
+def compressed_copies(fname):
+    """ gzip, bzip2 and BGZF copies of fname """
+    copies = []
+    for suffix,opener in [('.gz',gzip.open),('.bz2',bz2.BZ2File)]:
+        out = opener(fname+suffix,'wb')
+        out.write(open(fname,'rb').read())
+        out.close()
+        copies.append((suffix,fname+suffix))
+    bgzip(fname,fname+'.bgz')
+    copies.append(('.gz (BGZF, parallel)',fname+'.bgz'))
+    return copies
+
+def bench_compressed(fname):
+    copies = compressed_copies(fname)
+    try:
+        old,told = timeit("fgetcols, plain file",rc.fgetcols,fname)
+        for suffix,cname in copies:
+            new,tnew = timeit("fgetcols, %s" % suffix,rc.fgetcols,cname)
+            for a,b in zip(old,new):
+                assert a.dtype == b.dtype and N.all(a == b)
+            print "%-40s %8.1fx" % ("  relative to plain",tnew/max(told,1e-9))
+    finally:
+        for suffix,cname in copies:
+            os.remove(cname)
+
+if __name__ == "__main__":
+    nrows = 100000
+    ncolumns = 50
+    if len(sys.argv) > 1:
+        nrows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ncolumns = int(sys.argv[2])
+    fd,fname = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        maketable(fname,nrows,ncolumns)
+        print "%d rows x %d columns, %.1f MB" % (nrows,ncolumns,
+                                   os.path.getsize(fname)/1.e6)
+        bench_fgetcols(fname)
+        bench_filter(fname,nrows)
+        bench_memmap(fname,nrows,ncolumns)
+        bench_parallel(fname)
+        bench_compressed(fname)
+    finally:
+        os.remove(fname)
@@ -26,6 +26,12 @@
        c,d = f.getcols(3,4)
        f.close()
 
+   For very large numeric tables, readcol('foo',memmap=True) maps the file
+   and keeps only the offsets of its lines instead of the lines themselves.
+   To work through a file in blocks of rows:
+       for a,b in iter_fgetcols('foo',1,2,nrows=100000):
+           ...
+
    Ignores comment lines.
    Ignores blank lines. 
    Optionally changes INDEF to a desired value (e.g. -99.99).
@@ -37,64 +43,348 @@
 __version__ = '5.0' # Numpy is now the default
 __author = 'Henry C. Ferguson, STScI'
 
+import os
 import string
+import mmap
+import itertools
+import functools
+import multiprocessing
+import struct
+import zlib
+import bz2
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 import numpy
 
+def filterlines(lines,cmt='#',indef=None):
+    """Generator over the data lines of a file (or any sequence of strings).
+       Strips each line, drops blank lines and lines starting with cmt,
+       and replaces INDEF with indef if it is given.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == cmt:
+            continue
+        if indef:
+            line = line.replace("INDEF",indef)
+        yield line
+
+def readlines(cfile,cmt='#',indef=None):
+    """Read the data lines of a file into a list, through filterlines."""
+    return list(filterlines(datalines(cfile),cmt,indef))
+
+def datalines(cfile):
+    """Generator over the lines of a file. Files compressed with gzip,
+       bzip2 or xz are decompressed as they are read.
+    """
+    if compression(cfile) == None:
+        f = open(cfile,'r')
+        try:
+            for line in f:
+                yield line
+        finally:
+            f.close()
+    else:
+        for line in blocklines(decompress(cfile)):
+            yield line
+
+def compression(cfile):
+    """'gz', 'bz2' or 'xz' if the file is compressed (going by its first
+       bytes, not its name), otherwise None.
+    """
+    f = open(cfile,'rb')
+    magic = f.read(6)
+    f.close()
+    if magic[:2] == '\x1f\x8b':
+        return 'gz'
+    elif magic[:3] == 'BZh':
+        return 'bz2'
+    elif magic == '\xfd7zXZ\x00':
+        return 'xz'
+    return None
+
+def decompressor(kind):
+    if kind == 'gz':
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+    elif kind == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif lzma == None:
+        raise IOError, "readcol: the lzma module is needed for .xz files"
+    return lzma.LZMADecompressor()
+
+def decompress(cfile,blocksize=1<<20,nproc=None):
+    """Generator over blocks of decompressed text from a compressed file.
+       Files made of several streams (such as multi-member gzip files)
+       are read through to the end. Gzip files in blocks that record
+       their own size (BGZF, as written by bgzip) are decompressed by
+       nproc processes (default: one per cpu).
+    """
+    kind = compression(cfile)
+    if kind == 'gz' and nproc != 1:
+        members = gzipmembers(cfile)
+        if members != None and len(members) > 1:
+            for text in gunzipmembers(cfile,members,nproc):
+                yield text
+            return
+    f = open(cfile,'rb')
+    try:
+        d = decompressor(kind)
+        data = f.read(blocksize)
+        while data:
+            try:
+                text = d.decompress(data)
+            except EOFError: # The previous stream has ended
+                d = decompressor(kind)
+                continue
+            if text:
+                yield text
+            if d.unused_data:
+                data = d.unused_data
+                d = decompressor(kind)
+            else:
+                data = f.read(blocksize)
+    finally:
+        f.close()
+
+def blocklines(blocks):
+    """Generator over the lines in a sequence of blocks of text."""
+    rest = ''
+    for text in blocks:
+        lines = (rest+text).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+def gzipmembers(cfile):
+    """Offsets and sizes of the members of a gzip file whose headers give
+       the member size (the BC field of BGZF). None for other files.
+    """
+    members = []
+    size = os.path.getsize(cfile)
+    f = open(cfile,'rb')
+    try:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            head = f.read(12)
+            if len(head) < 12 or head[:2] != '\x1f\x8b' or \
+               not ord(head[3]) & 4:
+                return None
+            xlen = struct.unpack('<H',head[10:12])[0]
+            extra = f.read(xlen)
+            bsize = None
+            i = 0
+            while i+4 <= len(extra):
+                slen = struct.unpack('<H',extra[i+2:i+4])[0]
+                if extra[i:i+2] == 'BC' and slen == 2:
+                    bsize = struct.unpack('<H',extra[i+4:i+6])[0]
+                i = i+4+slen
+            if bsize == None:
+                return None
+            members.append((offset,bsize+1))
+            offset = offset+bsize+1
+    finally:
+        f.close()
+    return members
+
+def gunziprange(byterange,cfile=None):
+    """Decompress the gzip members in one byte range of a file."""
+    f = open(cfile,'rb')
+    f.seek(byterange[0])
+    data = f.read(byterange[1]-byterange[0])
+    f.close()
+    text = []
+    while data:
+        d = zlib.decompressobj(16+zlib.MAX_WBITS)
+        text.append(d.decompress(data))
+        data = d.unused_data
+    return ''.join(text)
+
+def gunzipmembers(cfile,members,nproc=None,groupsize=1<<22):
+    """Decompress gzip members with a pool of processes, in groups of
+       about groupsize compressed bytes. Yields the text in file order.
+       Only about two groups per process are decompressed ahead of the
+       reader, so memory use does not grow with the file.
+    """
+    ranges = []
+    start = members[0][0]
+    for offset,size in members:
+        if offset+size-start >= groupsize:
+            ranges.append((start,offset+size))
+            start = offset+size
+    if start < members[-1][0]+members[-1][1]:
+        ranges.append((start,members[-1][0]+members[-1][1]))
+    if nproc is None:
+        nproc = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(nproc)
+    try:
+        pending = []
+        for r in ranges:
+            pending.append(pool.apply_async(gunziprange,(r,cfile)))
+            if len(pending) >= 2*nproc:
+                yield pending.pop(0).get()
+        while pending:
+            yield pending.pop(0).get()
+    finally:
+        pool.terminate()
+        pool.join()
+
 def remove_comments(l,cmt='#'):
-    comments = []
-    for i in range(len(l)):
-        l[i] = l[i].strip()
-        if l[i] == '\n' or l[i][0] == cmt:
-            comments = comments + [i]
-    ngone = 0
-    for i in comments:
-        comment = l.pop(i-ngone)
-        ngone = ngone+1
+    """Strip the lines in l and remove comments and blank lines, in place."""
+    n = 0
+    for line in filterlines(l,cmt):
+        l[n] = line
+        n = n+1
+    del l[n:]
     return l
 
 def replace_indef(l,indef):
     for i in range(len(l)):
-        while string.find(l[i],"INDEF") > -1:
-            idx = string.find(l[i],"INDEF")
-            l[i] = l[i][:idx]+indef+l[i][idx+5:]
+        l[i] = l[i].replace("INDEF",indef)
     return l
 
 class readcol:
     """Column-oriented file methods."""
-    def __init__(self,cfile,arraytype=numpy,indef=""):
+    def __init__(self,cfile,arraytype=numpy,indef="",memmap=False,
+                 schema=False):
         """Open file, read in all the lines, and return numpy arrays.
           
            Arguments:
            cfile -- file to read
            arraytype -- numpy (used to allow Numeric or numarray)
            indef -- string replacement for INDEF (e.g. NaN)
+           memmap -- memory-map the file and keep only an index of line
+                     offsets; numeric columns are parsed straight from
+                     the mapped file (for very large tables); ignored
+                     for compressed files
+           schema -- use and update the cache of column types (schemas)
         """
-        f = open(cfile,'r')
-        self.l = f.readlines()
-        self.l = remove_comments(self.l)
-        if indef:
-            self.l = replace_indef(self.l,indef)
-        f.close()
         self.N = arraytype
-    def getcol(self,col,fs=None):
+        self.memmap = memmap and compression(cfile) == None
+        self.cfile = cfile
+        self.schema = schema
+        self.indef = indef
+        if self.memmap:
+            self.f = open(cfile,'r')
+            self.mm = mapfile(self.f)
+            self.starts,self.ends = lineindex(self.mm)
+            self.types = None
+            if len(self.starts) > 0:
+                first = self.mm[self.starts[0]:self.ends[0]]
+                if indef:
+                    first = first.replace("INDEF",indef)
+                self.types = [columntype(a) for a in first.split()]
+        else:
+            self.l = readlines(cfile,indef=indef)
+    def getcol(self,col,fs=None,dtype=None,nulls=None,masked=False,
+               fill=-99):
         """Read in a single column (columns start at 1)."""
-        return getcol(col,self.l,self.N,fs=fs)
-    def getcols(self,*args,**kwargs):
-        """Read in a multiple columns (columns start at 1)."""
+        if self.memmap or self.schema or dtype != None:
+            if dtype != None:
+                dtype = [dtype]
+            return self.getcols(col,fs=fs,dtypes=dtype,nulls=nulls,
+                                masked=masked,fill=fill)[0]
+        return getcol(col,self.l,self.N,fs=fs,nulls=nulls,masked=masked,
+                      fill=fill)
+    def getcols(self,*args,**keywords):
+        """Read in a multiple columns (columns start at 1). The dtypes
+           keyword gives the column types (a sequence matched to the
+           columns, or a dictionary keyed by column) instead of taking
+           them from the first line. The nulls, masked and fill keywords
+           are as in fgetcols.
+        """
         if 'fs' in keywords.keys():
             fs = keywords['fs']
         else:
             fs = None
-        ret = []
-        for i in range(len(args)):
-           ret = ret + [getcol(args[i],self.l,self.N,fs=fs)]
-        return ret
+        if 'dtypes' in keywords.keys():
+            dtypes = keywords['dtypes']
+        else:
+            dtypes = None
+        nulls,masked,fill = nullkeywords(keywords)
+        given = coltypes(args,dtypes)
+        types,key = self.gettypes(given,fs)
+        if not self.memmap:
+            values = getcols(args,self.l,self.N,fs=fs,dtypes=types,
+                             nulls=nulls,masked=masked,fill=fill)
+        else:
+            typelist = self.mmaptypes(types)
+            if fs != None or nulls or \
+               'str' in [typelist[c-1] for c in args]:
+                values = getcols(args,self.lines(),self.N,fs=fs,
+                                 dtypes=types,nulls=nulls,masked=masked,
+                                 fill=fill)
+            else:
+                values = mmapcols(args,self.mm,self.starts,self.ends,
+                                  typelist,self.N,indef=self.indef)
+        if key != None:
+            recordtypes(key,args,values,given)
+        return values
+    def gettypes(self,given,fs):
+        """Column types from the schema cache (if it is used) and the
+           given types, and the key of the cache entry.
+        """
+        types = {}
+        key = None
+        if self.schema:
+            key = schemakey(self.cfile,fs=fs,indef=self.indef)
+            types.update(schemas.get(key,{}))
+        types.update(given)
+        return types,key
+    def mmaptypes(self,types):
+        """The list of first-line types, updated with types."""
+        typelist = list(self.types)
+        for c in types.keys():
+            typelist[c-1] = types[c]
+        return typelist
+    def iterchunks(self,cols,nrows=100000,fs=None,dtypes=None):
+        """Iterate over the columns cols (starting at 1) in blocks of
+           nrows lines, yielding a tuple of arrays for each block. Integer
+           columns that turn into floats in one block stay float in the
+           following ones.
+        """
+        if not self.memmap:
+            return iterchunks(cols,self.l,self.N,nrows,fs=fs,dtypes=dtypes)
+        if not cols:
+            cols = range(1,len(self.types)+1)
+        types = self.mmaptypes(coltypes(cols,dtypes))
+        if fs != None or 'str' in [types[c-1] for c in cols]:
+            return iterchunks(cols,self.iterlines(),self.N,nrows,fs=fs,
+                              dtypes=dtypes)
+        return self.itermmap(cols,nrows,types)
+    def itermmap(self,cols,nrows,types):
+        for block in mmapblocks(cols,self.mm,self.starts,self.ends,types,
+                                self.N,self.indef,nrows):
+            yield promote(cols,block,types,self.N)
+    def iterlines(self):
+        """Generator over the data lines of the memory-mapped file."""
+        mm = self.mm
+        for i in range(len(self.starts)):
+            line = mm[self.starts[i]:self.ends[i]].strip()
+            if self.indef:
+                line = line.replace("INDEF",self.indef)
+            yield line
+    def lines(self):
+        """List of the data lines (read from the memory-mapped file)."""
+        return list(self.iterlines())
     def close(self):
         """Release the memory associated with the lines read by __init__"""
-        del(self.l)
+        if self.memmap:
+            self.mm.close()
+            self.f.close()
+            del(self.starts,self.ends)
+        else:
+            del(self.l)
         
 
-def getcol(col,lines,N,fs=None):
+def getcol(col,lines,N,fs=None,nulls=None,masked=False,fill=-99):
   """Read in a single column from a list of strings. Parse each column to
      determine the type of variable (integer, float, string) and return 
      either an array of that type (int64, float64) or a character array.
@@ -103,7 +393,12 @@ def getcol(col,lines,N,fs=None):
      col -- desired column (starting at 1)	
      lines -- list of strings (one per line) read from input file
      N -- numpy
+     nulls -- values that mark missing data (e.g. ['INDEF']); see
+              nullvalues for what is returned
   """
+  if nulls:
+    return getcols([col],lines,N,fs=fs,nulls=nulls,masked=masked,
+                   fill=fill)[0]
   i = col-1
   nlines = len(lines)
   if fs != None: # If delimiter is not whitespace, remove the whitespace
@@ -136,6 +431,385 @@ def getcol(col,lines,N,fs=None):
       getfloats(col,lines,values,fs=fs)
   return values
 
+def getcols(cols,lines,N,fs=None,dtypes=None,nulls=None,masked=False,
+            fill=-99):
+  """Read in several columns from a list of strings, splitting each line
+     only once. Each column gets the same type as getcol would give it
+     (int64, float64 or a character array), unless dtypes gives it.
+     Returns a list of arrays.
+
+     Arguments:
+     cols -- desired columns (starting at 1)
+     lines -- list of strings (one per line) read from input file
+     N -- numpy
+     dtypes -- column types, as a sequence matched to cols or a
+               dictionary keyed by column
+     nulls,masked,fill -- missing values (see nullvalues)
+  """
+  types = coltypes(cols,dtypes)
+  if fs != None: # If delimiter is not whitespace, remove the whitespace
+      rows = [string.join(l.split()).split(fs) for l in lines]
+  else:
+      rows = [l.split() for l in lines]
+  if len(set(map(len,rows))) == 1:
+      columns = zip(*rows)
+      del rows
+      return [columnvalues(columns[col-1],N,types.get(col),nulls,masked,
+                           fill) for col in cols]
+  return [columnvalues([a[col-1] for a in rows],N,types.get(col),nulls,
+                       masked,fill) for col in cols]
+
+# Column types of files read with schema=True, keyed by schemakey
+schemas = {}
+
+def schemakey(cfile,cmt='#',fs=None,indef=None):
+  """Key for the schema cache: the path of the file, its size and
+     modification time, its header comments and the types of the values
+     on its first data line.
+  """
+  header,first = readhead(cfile,cmt,indef)
+  if fs != None:
+    tokens = string.join(first.split()).split(fs)
+  else:
+    tokens = first.split()
+  st = os.stat(cfile)
+  return (os.path.abspath(cfile),st.st_size,st.st_mtime,tuple(header),
+          tuple([columntype(a) for a in tokens]))
+
+def readhead(cfile,cmt='#',indef=None):
+  """The comment lines before the first data line, and that line."""
+  header = []
+  first = ''
+  f = datalines(cfile)
+  for line in f:
+    line = line.strip()
+    if not line:
+      continue
+    if line[0] == cmt:
+      header.append(line)
+      continue
+    first = line
+    break
+  f.close()
+  if indef:
+    first = first.replace("INDEF",indef)
+  return header,first
+
+def recordtypes(key,cols,values,given={}):
+  """Store the types of the arrays read for cols in the schema cache,
+     except for the columns whose types were given.
+  """
+  types = schemas.setdefault(key,{})
+  for c,v in zip(cols,values):
+    if c not in given:
+      types[c] = {'i':'int','f':'float'}.get(v.dtype.kind,'str')
+
+def typename(t):
+  """'int', 'float' or 'str' for a type name or a numpy dtype."""
+  if t in ('int','float','str'):
+    return t
+  kind = numpy.dtype(t).kind
+  if kind in 'iu':
+    return 'int'
+  elif kind == 'f':
+    return 'float'
+  elif kind in 'SUa':
+    return 'str'
+  raise ValueError, "readcol: unsupported column type %s" % str(t)
+
+def coltypes(cols,dtypes):
+  """Dictionary of column types keyed by column, from dtypes given either
+     as a dictionary or as a sequence matched to cols.
+  """
+  if dtypes == None:
+    return {}
+  if isinstance(dtypes,dict):
+    items = dtypes.items()
+  else:
+    if len(dtypes) != len(cols):
+      raise ValueError, "readcol: need one dtype per column"
+    items = zip(cols,dtypes)
+  return dict([(c,typename(t)) for c,t in items])
+
+def columntype(token):
+  """Type of a column from its first value, as getcol decides it:
+     'int', 'float' or 'str'.
+  """
+  if string.find(token,'.') < 0:
+    try:
+      x = int(token)
+    except:
+      return 'str'
+    return 'int'
+  else:
+    try:
+      x = float(token)
+    except:
+      return 'str'
+    return 'float'
+
+def columnvalues(tokens,N,coltype=None,nulls=None,masked=False,fill=-99):
+  """Convert the strings from one column to an array, with the same rules
+     as getcol: the first value decides between integers, floats and
+     strings, and integers become floats if a later value has a decimal
+     point (after its first character). coltype ('int', 'float' or 'str')
+     overrides the type of the first value. nulls, masked and fill are
+     passed to nullvalues.
+  """
+  if nulls:
+    return nullvalues(tokens,N,coltype,nulls,masked,fill)
+  if coltype == None:
+    coltype = columntype(tokens[0])
+  # int() and float() rather than astype, which does not always raise
+  # on bad strings
+  if coltype == 'str':
+    return N.array(tokens)
+  elif coltype == 'int':
+    try:
+      return N.array(map(int,tokens),N.int64)
+    except ValueError:
+      # Floats if a decimal point turns up before any non-integer
+      for i in range(len(tokens)):
+        if string.find(tokens[i],'.') > 0:
+          map(int,tokens[:i])
+          return N.array(map(float,tokens),N.float64)
+      raise
+  else:
+    return N.array(map(float,tokens),N.float64)
+
+def iterchunks(cols,lines,N,nrows=100000,fs=None,dtypes=None,nulls=None,
+               masked=False,fill=-99):
+  """Generator over blocks of nrows lines, yielding a tuple of arrays
+     (one per column) for each block. lines can be any iterable of data
+     lines, such as filterlines on an open file. The column types come
+     from the first line; once a later block turns an integer column into
+     floats, the column stays float for the remaining blocks.
+
+     Arguments:
+     cols -- desired columns (starting at 1); all columns if empty
+     lines -- iterable of strings (one per line)
+     N -- numpy
+     nrows -- number of lines per block
+     dtypes -- column types that override the first line (as in getcols)
+     nulls,masked,fill -- missing values (see nullvalues); the type of a
+                          column that is missing on the first line comes
+                          from its first block
+  """
+  lines = iter(lines)
+  types = None
+  while True:
+    block = list(itertools.islice(lines,nrows))
+    if len(block) == 0:
+      return
+    if fs != None: # If delimiter is not whitespace, remove the whitespace
+      rows = [string.join(l.split()).split(fs) for l in block]
+    else:
+      rows = [l.split() for l in block]
+    del block
+    if types == None:
+      types = [columntype(a) for a in rows[0]]
+      if nulls:
+        for i in range(len(types)):
+          if rows[0][i] in nulls:
+            types[i] = None
+      if not cols:
+        cols = range(1,len(types)+1)
+      given = coltypes(cols,dtypes)
+      for c in given.keys():
+        types[c-1] = given[c]
+    yield promote(cols,[columnvalues([a[c-1] for a in rows],N,types[c-1],
+                                     nulls,masked,fill)
+                        for c in cols],types,N)
+
+def promote(cols,values,types,N):
+  """Record integer columns of a block that came back as floats in types,
+     and the types of columns that had none yet (unless the block has no
+     values for them), and return the block as a tuple.
+  """
+  for k in range(len(cols)):
+    kind = values[k].dtype.kind
+    if types[cols[k]-1] == 'int' and kind == 'f':
+      types[cols[k]-1] = 'float'
+    elif types[cols[k]-1] == None and not allmissing(values[k]):
+      types[cols[k]-1] = {'i':'int','f':'float'}.get(kind,'str')
+  return tuple(values)
+
+def nullvalues(tokens,N,coltype,nulls,masked=False,fill=-99):
+  """Convert the strings from one column like columnvalues, treating the
+     strings in nulls as missing values. The type comes from the first
+     value that is not missing. Missing values are NaN in float columns.
+     An integer column with missing values is returned as a masked array
+     holding fill where values are missing. With masked=True, every
+     column is returned as a masked array. If every value is missing,
+     the type is coltype, or float (all NaN) if coltype is None.
+  """
+  values = N.array(tokens)
+  mask = N.in1d(values,list(nulls))
+  if not mask.any():
+    ret = columnvalues(tokens,N,coltype)
+    if masked:
+      ret = N.ma.array(ret)
+    return ret
+  good = values[~mask].tolist()
+  if len(good) > 0:
+    ret = columnvalues(good,N,coltype)
+  else:
+    ret = N.zeros(0,{'int':N.int64,'str':'S1'}.get(coltype,N.float64))
+  if ret.dtype.kind == 'S':
+    ret = values
+  else:
+    data = N.empty(len(values),ret.dtype)
+    data[~mask] = ret
+    if ret.dtype.kind == 'f':
+      data[mask] = N.nan
+      if not masked:
+        return data
+    else:
+      data[mask] = fill
+      return N.ma.array(data,mask=mask,fill_value=fill)
+    ret = data
+  if masked:
+    return N.ma.array(ret,mask=mask)
+  return ret
+
+def allmissing(values):
+  """True for a column from nullvalues with no values at all, whose type
+     is still undetermined (all NaN)."""
+  return (len(values) > 0 and values.dtype.kind == 'f' and
+          numpy.isnan(numpy.ma.getdata(values)).all())
+
+def nullkeywords(keywords):
+  """The nulls, masked and fill keywords of fgetcols and friends."""
+  nulls = None
+  masked = False
+  fill = -99
+  if 'nulls' in keywords.keys():
+    nulls = keywords['nulls']
+  if 'masked' in keywords.keys():
+    masked = keywords['masked']
+  if 'fill' in keywords.keys():
+    fill = keywords['fill']
+  return nulls,masked,fill
+
+def mapfile(f):
+  """Read-only memory map of an open file (an empty string if the file
+     is empty, since empty files cannot be mapped).
+  """
+  f.seek(0,2)
+  if f.tell() == 0:
+    return ''
+  return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+def lineindex(mm,cmt='#',blocksize=1<<26):
+  """Offsets of the data lines in a memory-mapped file. Returns arrays
+     of the start and end (exclusive, before the newline) of every line
+     that is not blank or a comment.
+  """
+  N = numpy
+  size = len(mm)
+  ends = []
+  for b0 in range(0,size,blocksize):
+    buf = N.frombuffer(mm[b0:b0+blocksize],N.uint8)
+    ends.append(N.flatnonzero(buf == 10)+b0)
+  ends = N.concatenate(ends+[N.zeros(0,N.int64)]).astype(N.int64)
+  if size > 0 and mm[size-1] != '\n':
+    ends = N.append(ends,size)
+  starts = N.concatenate([[0],ends[:-1]+1]).astype(N.int64)
+  if len(ends) == 0:
+    return starts[:0],ends
+  first = N.empty(len(starts),N.uint8)
+  for b0 in range(0,size,blocksize):
+    buf = N.frombuffer(mm[b0:b0+blocksize],N.uint8)
+    i0,i1 = N.searchsorted(starts,[b0,b0+len(buf)])
+    first[i0:i1] = buf[starts[i0:i1]-b0]
+  # Lines that start with white space need a closer look
+  keep = (first != ord(cmt)) & (starts < ends)
+  for i in N.flatnonzero(keep & ((first == 32) | (first == 9) |
+                                 (first == 13))):
+    line = mm[starts[i]:ends[i]].strip()
+    keep[i] = (len(line) > 0) and (line[0] != cmt)
+  return starts[keep],ends[keep]
+
+def mmapcols(cols,mm,starts,ends,types,N,indef=None,nlines=100000):
+  """Read numeric columns from a memory-mapped file, nlines at a time.
+
+     Arguments:
+     cols -- desired columns (starting at 1)
+     mm -- memory-mapped file
+     starts,ends -- line offsets from lineindex
+     types -- column types ('int' or 'float') from the first line
+     N -- numpy
+     indef -- string replacement for INDEF
+  """
+  blocks = list(mmapblocks(cols,mm,starts,ends,types,N,indef,nlines))
+  if len(blocks) == 0:
+    return [N.zeros(0,N.float64) for c in cols]
+  return [N.concatenate([b[k] for b in blocks]) for k in range(len(cols))]
+
+def mmapblocks(cols,mm,starts,ends,types,N,indef=None,nlines=100000):
+  """Generator over blocks of nlines lines of a memory-mapped file,
+     yielding a list of arrays (one per column) for each block.
+  """
+  for i in range(0,len(starts),nlines):
+    s = starts[i:i+nlines]
+    e = ends[i:i+nlines]
+    if N.all(s[1:] == e[:-1]+1):
+      chunk = mm[s[0]:e[-1]]
+    else:
+      chunk = '\n'.join([mm[a:b] for a,b in zip(s,e)])
+    if indef:
+      chunk = chunk.replace("INDEF",indef)
+    yield parseblock(cols,chunk,len(s),types,N)
+
+def parseblock(cols,chunk,nlines,types,N):
+  """Parse numeric columns from a block of lines with fromstring. An
+     integer column becomes float if one of its values has a decimal
+     point after its first character. Blocks that cannot be read that
+     way (ragged lines, letters or leading decimal points in integer
+     columns, integers too large for a float) go through columnvalues.
+  """
+  ncols = len(types)
+  b = N.frombuffer(chunk,N.uint8)
+  ws = (b == 32) | (b == 9) | (b == 10) | (b == 13)
+  tokstart = N.flatnonzero(~ws & N.concatenate([[True],ws[:-1]]))
+  # Same number of values on every line
+  newlines = N.concatenate([N.flatnonzero(b == 10),[len(b)]])
+  values = None
+  if N.all(N.diff(N.searchsorted(tokstart,newlines)) == ncols) and \
+     len(tokstart) == nlines*ncols:
+    values = N.fromstring(chunk,N.float64,sep=' ')
+  if values is None or len(values) != nlines*ncols:
+    return slowblock(cols,chunk,types,N)
+  values = values.reshape(nlines,ncols)
+  ret = []
+  dotcols = None
+  for c in cols:
+    v = values[:,c-1]
+    if types[c-1] == 'int':
+      if dotcols is None:
+        # Columns with decimal points, letters or leading points
+        dots = N.flatnonzero(b == 46)
+        tok = N.searchsorted(tokstart,dots,'right')-1
+        dotcols = set(tok % ncols)
+        bad = tok[dots == tokstart[tok]]
+        letters = N.flatnonzero(b >= 65)
+        bad = N.concatenate([bad,
+                  N.searchsorted(tokstart,letters,'right')-1])
+        badcols = set(bad % ncols)
+      if c-1 in badcols:
+        return slowblock(cols,chunk,types,N)
+      if c-1 not in dotcols:
+        if N.any(N.abs(v) >= 2.**53):
+          return slowblock(cols,chunk,types,N)
+        v = v.astype(N.int64)
+    ret.append(v.copy())
+  return ret
+
+def slowblock(cols,chunk,types,N):
+  """Split a block of lines and convert the columns with columnvalues."""
+  rows = [l.split() for l in chunk.split('\n')]
+  return [columnvalues([a[c-1] for a in rows],N,types[c-1]) for c in cols]
+
 def getstrings(col,lines,values,fs=None):
   n = 0
   for l in lines:
@@ -163,7 +837,8 @@ def getfloats(col,lines,values,fs=None):
     n = n+1
 
 
-def fgetcol(cfile,col,arraytype="numpy",cmt='#',indef="-99.99"):
+def fgetcol(cfile,col,arraytype="numpy",cmt='#',indef="-99.99",dtype=None,
+            schema=False,nulls=None,masked=False,fill=-99):
     """Read in a single column from a file. Parse the column to
        determine the type of variable (integer, float, string) and return 
        either an array of that type (int64, float64) or a character array.
@@ -173,13 +848,20 @@ def fgetcol(cfile,col,arraytype="numpy",cmt='#',indef="-99.99"):
        col -- desired column (starting at 1)	
        arraytype -- numpy
        indef="-99.99" (INDEF replacement string)
+       dtype=None (type of the column, instead of parsing it)
+       schema=False (use and update the cache of column types)
+       nulls=None, masked=False, fill=-99 (missing values, as in fgetcols;
+          indef is not used when nulls is given)
     """
-    f = open(cfile,'r')
-    l = f.readlines()
-    f.close()
-    l = remove_comments(l,cmt=cmt)
-    if indef:
-        l = replace_indef(l,indef)
+    if nulls:
+        indef = None
+    if dtype != None or schema or nulls:
+        if dtype != None:
+            dtype = [dtype]
+        return fgetcols(cfile,col,cmt=cmt,indef=indef,dtypes=dtype,
+                        schema=schema,nulls=nulls,masked=masked,
+                        fill=fill)[0]
+    l = readlines(cfile,cmt=cmt,indef=indef)
     if arraytype == "numpy":
         N = numpy
     return getcol(col,l,N)
@@ -196,6 +878,16 @@ def fgetcols(cfile,*args,**keywords):
        **keywords -- indef="-99.99" (INDEF replacement string)
                   -- cmt="#" (comment character)
                   -- fs=None (field separator; defaults to whitespace)
+                  -- dtypes=None (column types instead of parsing them;
+                     'int', 'float', 'str' or numpy types, as a sequence
+                     matched to the columns or a dictionary keyed by column)
+                  -- schema=False (use and update the cache of the final
+                     column types of files with the same path and layout)
+                  -- nulls=None (values that mark missing data, such as
+                     ['INDEF']; they become NaN in float columns, and an
+                     int column with missing values is a masked array)
+                  -- masked=False (return every column as a masked array)
+                  -- fill=-99 (data value under the mask in int columns)
 
        Examples:
          If the file 'foo' has three columns, read them in as follows:
@@ -206,19 +898,19 @@ def fgetcols(cfile,*args,**keywords):
              a = fgetcols('foo')               # read all columns 
              a,b,c = fgetcols('foo',fs=',')    # Change the field separator
              a,b,c = fgetcols('foo',cmt='!')   # Change the comment character to '!'
+             a,b = fgetcols('foo',1,2,dtypes=('int','float'))
+             a,b = fgetcols('foo',1,2,nulls=['INDEF'])  # INDEF -> NaN
 
     """
-    f = open(cfile,'r')
-    l = f.readlines()
-    f.close()
     if 'cmt' in keywords.keys():
         cmt = keywords['cmt']
     else:
         cmt = '#'
-    l = remove_comments(l,cmt=cmt)
     if 'indef' in keywords.keys():
         indef = keywords['indef']
-        l = replace_indef(l,indef)
+    else:
+        indef = None
+    l = readlines(cfile,cmt=cmt,indef=indef)
     N = numpy
     if 'arraytype' in keywords.keys():
         arraytype = keywords['arraytype']
@@ -228,12 +920,193 @@ def fgetcols(cfile,*args,**keywords):
         fs = keywords['fs']
     else:
         fs = None
-    ret = []
-    ncols = len(args)
     colnumbers = args
-    if ncols == 0:       # If no columns are listed, read them all
+    if len(colnumbers) == 0:       # If no columns are listed, read them all
         ncols = len(l[0].split(fs))
-        colnumbers = N.array(range(ncols))+1
-    for i in range(ncols):
-        ret = ret + [getcol(colnumbers[i],l,N,fs=fs)]
-    return ret
+        colnumbers = range(1,ncols+1)
+    types = {}
+    if 'schema' in keywords.keys() and keywords['schema']:
+        key = schemakey(cfile,cmt=cmt,fs=fs,indef=indef)
+        types.update(schemas.get(key,{}))
+    else:
+        key = None
+    if 'dtypes' in keywords.keys():
+        given = coltypes(colnumbers,keywords['dtypes'])
+    else:
+        given = {}
+    types.update(given)
+    nulls,masked,fill = nullkeywords(keywords)
+    values = getcols(colnumbers,l,N,fs=fs,dtypes=types,nulls=nulls,
+                     masked=masked,fill=fill)
+    if key != None:
+        recordtypes(key,colnumbers,values,given)
+    return values
+
+def iter_fgetcols(cfile,*args,**keywords):
+    """Iterate over columns of a file in blocks of rows, without reading
+       the whole file. Yields a tuple of arrays for each block. Takes the
+       same keywords as fgetcols except schema, plus nrows (lines per
+       block, default 100000). Column types come from the first line; an integer column
+       that turns into floats in one block stays float in later blocks.
+
+       Example:
+         total = 0.
+         for a,b in iter_fgetcols('foo',1,3,nrows=50000):
+             total = total + (a*b).sum()
+    """
+    if 'cmt' in keywords.keys():
+        cmt = keywords['cmt']
+    else:
+        cmt = '#'
+    if 'indef' in keywords.keys():
+        indef = keywords['indef']
+    else:
+        indef = None
+    if 'fs' in keywords.keys():
+        fs = keywords['fs']
+    else:
+        fs = None
+    if 'nrows' in keywords.keys():
+        nrows = keywords['nrows']
+    else:
+        nrows = 100000
+    if 'dtypes' in keywords.keys():
+        dtypes = keywords['dtypes']
+    else:
+        dtypes = None
+    nulls,masked,fill = nullkeywords(keywords)
+    f = datalines(cfile)
+    try:
+        for block in iterchunks(args,filterlines(f,cmt,indef),numpy,nrows,
+                                fs=fs,dtypes=dtypes,nulls=nulls,
+                                masked=masked,fill=fill):
+            yield block
+    finally:
+        f.close()
+
+def byteranges(cfile,nranges):
+  """Split a file into nranges byte ranges that start and end at the
+     beginning of a line. Returns a list of (start,end) pairs.
+  """
+  size = os.path.getsize(cfile)
+  f = open(cfile,'r')
+  bounds = [0]
+  for i in range(1,nranges):
+    f.seek(max(size*i/nranges-1,bounds[-1]))
+    f.readline()
+    bounds.append(max(f.tell(),bounds[-1]))
+  f.close()
+  bounds.append(size)
+  return [(bounds[i],bounds[i+1]) for i in range(nranges)
+          if bounds[i+1] > bounds[i]]
+
+def readrange(byterange,cfile=None,cols=None,types=None,cmt='#',
+              indef=None,fs=None,nulls=None,masked=False,fill=-99):
+  """Read columns from one byte range of a file, for pfgetcols. Returns
+     a list of arrays, or None if the range has no data lines.
+  """
+  f = open(cfile,'r')
+  f.seek(byterange[0])
+  chunk = f.read(byterange[1]-byterange[0])
+  f.close()
+  l = list(filterlines(chunk.split('\n'),cmt,indef))
+  del chunk
+  if len(l) == 0:
+    return None
+  return getcols(cols,l,numpy,fs=fs,dtypes=types,nulls=nulls,
+                 masked=masked,fill=fill)
+
+def pfgetcols(cfile,*args,**keywords):
+    """Read multiple columns from a file with several processes, each
+       parsing a range of lines. Takes the same keywords as fgetcols
+       (except schema), plus nproc (number of processes, default: one
+       per cpu). The column types come from the first line (or dtypes);
+       an integer column is float in the result if any range turned it
+       into floats. Compressed files are read with fgetcols, since they
+       cannot be split into byte ranges.
+
+       Example:
+         a,b,c = pfgetcols('foo',1,2,5,nproc=8)
+    """
+    if compression(cfile) != None:
+        return fgetcols(cfile,*args,**keywords)
+    if 'cmt' in keywords.keys():
+        cmt = keywords['cmt']
+    else:
+        cmt = '#'
+    if 'indef' in keywords.keys():
+        indef = keywords['indef']
+    else:
+        indef = None
+    if 'fs' in keywords.keys():
+        fs = keywords['fs']
+    else:
+        fs = None
+    if 'nproc' in keywords.keys() and keywords['nproc']:
+        nproc = keywords['nproc']
+    else:
+        nproc = multiprocessing.cpu_count()
+    header,first = readhead(cfile,cmt,indef)
+    if fs != None:
+        tokens = string.join(first.split()).split(fs)
+    else:
+        tokens = first.split()
+    colnumbers = args
+    if len(colnumbers) == 0:       # If no columns are listed, read them all
+        colnumbers = range(1,len(tokens)+1)
+    nulls,masked,fill = nullkeywords(keywords)
+    types = dict([(c,columntype(tokens[c-1])) for c in colnumbers
+                  if not (nulls and tokens[c-1] in nulls)])
+    if 'dtypes' in keywords.keys():
+        types.update(coltypes(colnumbers,keywords['dtypes']))
+    reader = functools.partial(readrange,cfile=cfile,cols=colnumbers,
+                               types=types,cmt=cmt,indef=indef,fs=fs,
+                               nulls=nulls,masked=masked,fill=fill)
+    ranges = byteranges(cfile,nproc)
+    if nproc == 1:
+        blocks = map(reader,ranges)
+    else:
+        pool = multiprocessing.Pool(nproc)
+        try:
+            blocks = pool.map(reader,ranges,1)
+        finally:
+            pool.close()
+            pool.join()
+    blocks = [b for b in blocks if b != None]
+    # Integer columns become float if any block has floats. Blocks with
+    # no values at all in a column do not count.
+    values = []
+    for k in range(len(colnumbers)):
+        parts = [b[k] for b in blocks]
+        kinds = [p.dtype.kind for p in parts if not allmissing(p)]
+        if 'i' in kinds and 'f' not in kinds:
+            # All missing in some blocks, integers in the others
+            for i in range(len(parts)):
+                if allmissing(parts[i]):
+                    n = len(parts[i])
+                    parts[i] = numpy.ma.array(numpy.zeros(n,numpy.int64)+fill,
+                                              mask=numpy.ones(n,bool),
+                                              fill_value=fill)
+        if 'f' in [p.dtype.kind for p in parts]:
+            floats = []
+            for p in parts:
+                if isinstance(p,numpy.ma.MaskedArray) and p.dtype.kind == 'i':
+                    # Missing values are NaN in float columns, as in
+                    # nullvalues, and only stay masked if masked=True
+                    mask = numpy.ma.getmaskarray(p)
+                    p = p.data.astype(numpy.float64)
+                    p[mask] = numpy.nan
+                    if masked:
+                        p = numpy.ma.array(p,mask=mask)
+                else:
+                    p = p.astype(numpy.float64)
+                floats.append(p)
+            parts = floats
+        if True in [isinstance(p,numpy.ma.MaskedArray) for p in parts]:
+            v = numpy.ma.concatenate(parts)
+            if v.dtype.kind == 'i':
+                v.set_fill_value(fill)
+            values.append(v)
+        else:
+            values.append(numpy.concatenate(parts))
+    return values
@@ -0,0 +1,95 @@
+# Benchmarks for numprint_ferguson.py
+#
+# Formats a synthetic table with printcols and with the row-by-row loop
+# it used to have, and writes it to a file with and without streaming,
+# checking that the output is the same.
+#
+# Usage: python bench_numprint.py [nrows] [ncolumns]
+
+import os, sys
+import tempfile
+import time
+import numpy as N
+
+import numprint_ferguson as numprint
+
+def timeit(label,func,*args,**keywords):
+    t0 = time.time()
+    ret = func(*args,**keywords)
+    dt = time.time()-t0
+    print "%-40s %8.3f s" % (label,dt)
+    return ret,dt
+
+def legacy_printcols(fmt,*args):
+    """ One list, one tuple and one % per row, as printcols used to """
+    n = len(args[0])
+    ncols = len(args)
+    newcols = []
+    for i in range(n):
+        l = []
+        for ii in range(ncols):
+            l = l + [args[ii][i]]
+        ll = tuple(l)
+        s = fmt % ll
+        newcols += [s]
+    return(newcols)
+
+def maketable(nrows,ncolumns,seed=42):
+    """ An integer id column followed by ncolumns-1 float columns, and a
+        format for them.
+    """
+    rng = N.random.RandomState(seed)
+    cols = [N.arange(nrows)]
+    fmt = '%8d'
+    for c in range(1,ncolumns):
+        cols.append(rng.uniform(-1000.,1000.,nrows))
+        fmt = fmt + [' %12.5e',' %10.4f'][c%2]
+    return fmt,cols
+
+def bench_printcols(nrows,ncolumns):
+    fmt,cols = maketable(nrows,ncolumns)
+    old,told = timeit("row by row",legacy_printcols,fmt,*cols)
+    new,tnew = timeit("printcols",numprint.printcols,fmt,*cols)
+    assert old == new
+    print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+
+def legacy_writeto(fname,fmt,cols):
+    """ Build the whole table with s += line, as format.writeto used to """
+    lines = legacy_printcols(fmt,*cols)
+    s = ''
+    for i in range(len(lines)):
+        s += lines[i]+'\n'
+    f = open(fname,'w')
+    f.write(s[:-1])
+    f.close()
+
+def stream_writeto(fname,fmt,cols):
+    numprint.format(fmt,*cols,**{'stream':True}).writeto(fname)
+
+def bench_writeto(nrows,ncolumns):
+    fmt,cols = maketable(nrows,ncolumns)
+    fd,old = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    fd,new = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        x,told = timeit("writeto, whole table in a string",
+                        legacy_writeto,old,fmt,cols)
+        x,tnew = timeit("format(stream=True).writeto",
+                        stream_writeto,new,fmt,cols)
+        assert open(old).read() == open(new).read()
+        print "%-40s %8.1fx" % ("speedup",told/max(tnew,1e-9))
+    finally:
+        os.remove(old)
+        os.remove(new)
+
+if __name__ == "__main__":
+    nrows = 1000000
+    ncolumns = 10
+    if len(sys.argv) > 1:
+        nrows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ncolumns = int(sys.argv[2])
+    print "%d rows x %d columns" % (nrows,ncolumns)
+    bench_printcols(nrows,ncolumns)
+    bench_writeto(nrows,ncolumns)
@@ -30,23 +30,41 @@ Usage example:
        2.0       4.00      1.414
        3.0       6.00      1.732
        4.0       8.00      2.000
+
+For very long tables, format(...,stream=True) keeps the arrays instead of
+the formatted lines, and writeto formats and writes them a block of rows
+at a time:
+
+>>> l = format("%10.1f %10.2f",x,y,stream=True)
+>>> l.writeto("table.txt")
 """
 
 __version__ = '1.0'
 __author__ = 'Henry C. Ferguson, STScI'
 
+import re
+
+# One % conversion: mapping key, flags, width, precision, length, type
+conversion = re.compile(r'%(\([^)]*\))?[#0 +-]*(\*|\d+)?(\.(\*|\d*))?'
+                        r'[hlL]?([diouxXeEfFgGcrs%])')
 
 class format:
     """Format a numpy array for printing"""
-    def __init__(self,fmt,*args):
+    def __init__(self,fmt,*args,**keywords):
         """Specify the print format for a set of columns.
 
            Arguments:
            fmt -- Standard format string
            args -- one-dimensional array to print. Must be the same length.
+           stream -- Keyword argument. If True, keep the arrays and only
+                format them when the output is needed, a block of rows at
+                a time. Default is False (format them now, into lines).
         """
         self.head=''
-        self.lines = printcols(fmt,*args)
+        if keywords.has_key('stream') and keywords['stream']:
+            self.groups = [('',fmt,args)]
+        else:
+            self.lines = printcols(fmt,*args)
     def heading(self,heading):
         """Specify the heading for a set of columns.
 
@@ -70,42 +88,147 @@ class format:
            separator -- Keyword argument. specifies a field separator to use 
                 between these new columns an the previous ones. Default is ' '.
         """
-        newcols = printcols(fmt,*args)
         if keywords.has_key('separator'):
             separator = keywords['separator']
         else:
             separator = ' ' 
+        if self.__dict__.has_key('groups'):
+            self.groups.append((separator,fmt,args))
+            return
+        newcols = printcols(fmt,*args)
         for i in range(len(newcols)):
             self.lines[i] = self.lines[i]+separator+newcols[i]
+    def __getattr__(self,name):
+        # The lines of a streaming format are made when asked for
+        if name == 'lines' and self.__dict__.has_key('groups'):
+            return [l for block in self.blocks() for l in block]
+        raise AttributeError, name
+    def blocks(self,blocksize=10000):
+        """Generator over the formatted lines, a list of blocksize lines
+           at a time.
+        """
+        if not self.__dict__.has_key('groups'):
+            for i in range(0,len(self.lines),blocksize):
+                yield self.lines[i:i+blocksize]
+            return
+        n = len(self.groups[0][2][0])
+        for i in range(0,n,blocksize):
+            lines = None
+            for separator,fmt,args in self.groups:
+                newcols = printcols(fmt,*[a[i:i+blocksize] for a in args])
+                if lines == None:
+                    lines = newcols
+                else:
+                    for k in range(len(newcols)):
+                        lines[k] = lines[k]+separator+newcols[k]
+            yield lines
     def __repr__(self):
         """Display the output (returns a string).""" 
-        s = ''
+        lines = self.lines
         if len(self.head) > 0:
-            s = self.head+'\n' 
-        for i in range(len(self.lines)):
-            s += self.lines[i]+'\n'
-	return s[:-1]
-    def writeto(self,file,append=0):
-        """Print the output to a file.""" 
-        if append:
+            lines = [self.head]+lines
+        return '\n'.join(lines)
+    def writeto(self,file,append=0,blocksize=10000):
+        """Print the output to a file (a file name or an open file),
+           a block of blocksize lines at a time.""" 
+        if hasattr(file,'write'):
+            f = file
+        elif append:
             f = open(file,'a')
         else:
             f = open(file,'w')
-        f.write(self.__repr__())
-        f.close
+        try:
+            start = ''
+            if len(self.head) > 0:
+                f.write(self.head)
+                start = '\n'
+            for block in self.blocks(blocksize):
+                if len(block) > 0:
+                    f.write(start+'\n'.join(block))
+                    start = '\n'
+        finally:
+            if f is not file:
+                f.close()
+
+def printcols(fmt,*args,**keywords):
+    """Format the arrays in args a row at a time with fmt, as fmt % row.
+       Returns a list of strings, one per row.
 
-def printcols(fmt,*args):
+       The format is parsed once. Each column is turned into a list in one
+       step, and then blocks of rows (blocksize keyword, default 10000)
+       are formatted with a single % on a repeated copy of the format.
+    """
+    if keywords.has_key('blocksize'):
+        blocksize = keywords['blocksize']
+    else:
+        blocksize = 10000
     n = len(args[0])
     ncols = len(args)
+    for a in args:
+        if len(a) < n:
+            raise IndexError, "printcols: columns must be the same length"
+    types = conversions(fmt)
+    if types == None or len(types) != ncols:
+        # Let % report the error, or deal with * and mapping keys
+        return [fmt % tuple([a[i] for a in args]) for i in range(n)]
+    cols = [columnlist(args[ii],types[ii],n) for ii in range(ncols)]
+    if '\n' in fmt or 'r' in types or 's' in types or 'c' in types:
+        # Rows can't be told apart by splitting at newlines
+        return [fmt % row for row in zip(*cols)]
+    values = [None]*(n*ncols)
+    for ii in range(ncols):
+        values[ii::ncols] = cols[ii]
+    del cols
+    rowfmt = fmt+'\n'
     newcols = []
-    for i in range(n):
-        l = []
-        for ii in range(ncols):
-            l = l + [args[ii][i]]
-        ll = tuple(l)
-        s = fmt % ll
-        newcols += [s]     
-    return(newcols)
+    for i in range(0,n,blocksize):
+        m = min(blocksize,n-i)
+        text = (rowfmt*m) % tuple(values[i*ncols:(i+m)*ncols])
+        newcols.extend(text[:-1].split('\n'))
+    return newcols
+
+def writecols(file,fmt,*args,**keywords):
+    """Format arrays and write them to a file (a file name or an open
+       file) a block of rows at a time, without keeping the formatted
+       table in memory. Same as format(fmt,*args,stream=True).writeto(file).
+
+       Arguments:
+       file -- file name or open file
+       fmt -- Standard format string
+       args -- one-dimensional arrays to print. Must be the same length.
+       heading -- Keyword argument. Heading line (e.g. column labels).
+       append -- Keyword argument. Append to the file (default False).
+       blocksize -- Keyword argument. Rows per block (default 10000).
+    """
+    l = format(fmt,*args,**{'stream':True})
+    if keywords.has_key('heading'):
+        l.heading(keywords['heading'])
+    append = keywords.has_key('append') and keywords['append']
+    if keywords.has_key('blocksize'):
+        l.writeto(file,append,keywords['blocksize'])
+    else:
+        l.writeto(file,append)
+
+def conversions(fmt):
+    """The type of each conversion in fmt (e.g. ['f','d']), or None if
+       fmt uses mapping keys or * widths.
+    """
+    types = []
+    for m in conversion.finditer(fmt):
+        if m.group(1) != None or m.group(2) == '*' or m.group(4) == '*':
+            return None
+        if m.group(5) != '%':
+            types.append(m.group(5))
+    return types
+
+def columnlist(a,type,n):
+    """The first n values of a as a list, for formatting with type. Numeric
+       arrays become Python numbers (which format the same way as numpy
+       scalars) unless they are formatted with %s or %r.
+    """
+    if hasattr(a,'dtype') and a.dtype.kind in 'biuf' and type not in 'rs':
+        return a[:n].tolist()
+    return list(a[:n])
 
 if __name__ == "__main__":
     from numpy import *